@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# coding=utf-8
+'''
+Parser benchmark, run by `run_bench.py` in a fresh process.
+
+Parses the C sources of a directory with `util.extract_functions_timed`
+and writes a run report, whose RSS peak is then the parser's own. Exits
+with `SKIP_EXIT` when tree-sitter or the prebuilt grammars are missing.
+'''
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR.joinpath("extractor")))
+sys.path.append(str(ROOT_DIR.joinpath("tplite", "src")))
+from profiling import RunReport  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SKIP_EXIT = 77
+
+
+def parameter_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--c_dir", type=Path, required=True,
+                        help="directory of the C sources")
+    parser.add_argument("--report", type=Path, required=True,
+                        help="run report to write")
+    return parser.parse_args()
+
+
+def main():
+    try:
+        from util import extract_functions_timed, get_file_info
+        get_file_info(b"int main(void) { return 0; }")
+    except Exception as e:
+        logger.warning(f"[*] skip the parser benchmark: {e}")
+        sys.exit(SKIP_EXIT)
+    sources = [c_path.read_bytes() for c_path in sorted(args.c_dir.glob("*.c"))]
+    report = RunReport("bench_parser").start()
+    cost = {"parse": 0.0, "hash": 0.0}
+    with report.stage("parse"):
+        for file_cont in sources:
+            funcs, parse_time, hash_time = extract_functions_timed(file_cont, False)
+            cost["parse"] += parse_time
+            cost["hash"] += hash_time
+            report.count("files")
+            report.count("bytes", len(file_cont))
+            report.count("functions", len(funcs))
+    report.record("cost", "parser", cost)
+    report.dump(args.report)
+
+
+if __name__ == "__main__":
+    args = parameter_parser()
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# coding=utf-8
+'''
+Synthetic tpl corpus for the benchmarks.
+
+Generates tpl signatures in the format of `extractor/extract_func.py`, the
+matching tpl name csv, and optionally C sources for the parser. The corpus
+is fully determined by its parameters and the seed.
+
+Each tpl owns its functions and may vendor a share of the functions of
+earlier tpls. Vendored copies are tagged later than the originals and are
+laid out under `config.EXTERN_FLAG` dirs, dirs named after the dependency,
+`config.BLACK_SET` dirs, or flat paths that leave only the birth time to
+decide the origin.
+'''
+import argparse
+import json
+import random
+import sys
+from hashlib import sha256
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1].joinpath("tplite", "src")))
+import config  # noqa: E402
+
+LAYOUTS = ["extern", "named", "blacklisted", "flat"]
+SCALES = {
+    "small": {"tpls": 100, "funcs": 200, "c_files": 50},
+    "medium": {"tpls": 500, "funcs": 500, "c_files": 200},
+    "large": {"tpls": 2000, "funcs": 1000, "c_files": 1000},
+}
+
+
+def parameter_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=Path, required=True,
+                        help="directory of the generated corpus")
+    parser.add_argument("--tpls", type=int, default=100,
+                        help="number of tpls")
+    parser.add_argument("--funcs", type=int, default=200,
+                        help="mean number of functions owned by a tpl")
+    parser.add_argument("--tags", type=int, default=5,
+                        help="max number of tags of a tpl")
+    parser.add_argument("--clone_rate", type=float, default=0.3,
+                        help="fraction of the tpls vendoring other tpls")
+    parser.add_argument("--deps", type=int, default=3,
+                        help="max number of tpls vendored by a cloning tpl")
+    parser.add_argument("--vendor_rate", type=float, default=0.5,
+                        help="fraction of a dependency's functions vendored")
+    parser.add_argument("--c_files", type=int, default=0,
+                        help="number of C source files for the parser")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def tag_times(rng, birth_year, tags):
+    '''Sorted commit times of the tags of a tpl'''
+    times = set()
+    while len(times) < tags:
+        year = birth_year + rng.randint(0, 5)
+        times.add(f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                  f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00")
+    return sorted(times)
+
+
+def vendor_path(rng, layout, dep_name, file_name):
+    if layout == "extern":
+        return f"{rng.choice(sorted(config.EXTERN_FLAG))}/{dep_name}/{file_name}"
+    if layout == "named":
+        return f"{dep_name}/{file_name}"
+    if layout == "blacklisted":
+        black = sorted(config.BLACK_SET - config.EXTERN_FLAG)
+        return f"{rng.choice(black)}/{dep_name}/{file_name}"
+    return f"lib/{file_name}"
+
+
+def generate_corpus(output, tpls=100, funcs=200, tags=5, clone_rate=0.3,
+                    deps=3, vendor_rate=0.5, c_files=0, seed=0):
+    '''Write the corpus, return its tpl ids in generation order'''
+    rng = random.Random(seed)
+    sig_dir = Path(output).joinpath("func_sigs")
+    sig_dir.mkdir(parents=True, exist_ok=True)
+    tpl_ids, tpl_names, owned = [], [], []
+    for i in range(tpls):
+        tpl_ids.append(sha256(f"{seed}:tpl:{i}".encode()).hexdigest()[:32])
+        tpl_names.append(f"tpl{i}")
+
+    for i in range(tpls):
+        birth_year = 1995 + i * 25 // max(tpls, 1)
+        times = tag_times(rng, birth_year, rng.randint(1, tags))
+        tpl_sig = dict()
+        func_hashes = []
+        for j in range(max(1, int(rng.gauss(funcs, funcs / 4)))):
+            func_hash = sha256(f"{seed}:func:{i}:{j}".encode()).hexdigest()
+            func_hashes.append(func_hash)
+            # a function appears from a random tag on
+            first = rng.randrange(len(times))
+            func_path = f"src/{tpl_names[i]}/file{j % 16}.c"
+            tpl_sig[func_hash] = [
+                f"int {tpl_names[i]}_f{j}(void) {{ return {j}; }}",
+                {f"v{k}": [times[k], func_path] for k in range(first, len(times))}
+            ]
+
+        if i > 0 and rng.random() < clone_rate:
+            for dep in rng.sample(range(i), min(i, rng.randint(1, deps))):
+                layout = rng.choice(LAYOUTS)
+                dep_funcs = owned[dep]
+                vendored = rng.sample(dep_funcs, int(len(dep_funcs) * vendor_rate))
+                # vendored after both the dependency and this tpl exist
+                vendor_time = max(times[-1], f"{1995 + dep * 25 // tpls + 6}-06-01 00:00:00")
+                for func_hash in vendored:
+                    if func_hash in tpl_sig:
+                        continue
+                    func_path = vendor_path(
+                        rng, layout, tpl_names[dep], f"file{rng.randrange(16)}.c"
+                    )
+                    tpl_sig[func_hash] = ["", {"vendor": [vendor_time, func_path]}]
+        owned.append(func_hashes)
+
+        with open(sig_dir.joinpath(f"{tpl_ids[i]}.json"), 'w') as fp:
+            json.dump(tpl_sig, fp)
+
+    with open(Path(output).joinpath("tpls_name.csv"), 'w') as fp:
+        fp.write("tpl_uuid,tpl_name\n")
+        for tpl_id, tpl_name in zip(tpl_ids, tpl_names):
+            fp.write(f"{tpl_id},{tpl_name}\n")
+
+    if c_files:
+        generate_c_sources(Path(output).joinpath("c_src"), c_files, rng)
+    return tpl_ids
+
+
+C_SNIPPETS = [
+    "    for (int i = 0; i < n; i++) {{\n        acc += buf[i] * {k};\n    }}\n",
+    "    if (acc > {k}) {{\n        acc -= {k};\n    }} else {{\n        acc += n;\n    }}\n",
+    "    switch (n % 3) {{\n    case 0: acc ^= {k}; break;\n    default: acc |= {k};\n    }}\n",
+    "    while (n-- > 0) {{\n        acc = (acc << 1) ^ {k};\n    }}\n",
+    "    acc += STR_LEN(\"name_{k}\");\n",
+]
+
+
+def generate_c_sources(c_dir, c_files, rng, funcs_per_file=40):
+    '''C files mixing loops, branches, macros and string literals'''
+    c_dir.mkdir(parents=True, exist_ok=True)
+    for f in range(c_files):
+        lines = ["#include <stddef.h>\n",
+                 "#define STR_LEN(s) (sizeof(s) - 1)\n",
+                 f"#define NAME_{f} \"file_{f}\"\n\n",
+                 "struct ctx { int n; unsigned char *buf; };\n\n"]
+        for j in range(funcs_per_file):
+            body = "".join(rng.choice(C_SNIPPETS).format(k=rng.randint(1, 1 << 16))
+                           for _ in range(rng.randint(1, 6)))
+            lines.append(
+                f"/* function {j} */\nstatic int f{f}_{j}(const unsigned char *buf, int n)\n"
+                f"{{\n    int acc = 0;\n{body}    return acc;\n}}\n\n"
+            )
+        with open(c_dir.joinpath(f"file{f}.c"), 'w') as fp:
+            fp.writelines(lines)
+
+
+if __name__ == "__main__":
+    args = parameter_parser()
+    generate_corpus(
+        args.output, args.tpls, args.funcs, args.tags, args.clone_rate,
+        args.deps, args.vendor_rate, args.c_files, args.seed
+    )
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# coding=utf-8
+'''
+Benchmarks of the hot paths on synthetic corpora.
+
+For each scale, a corpus from `gen_corpus.py` is resolved by
+`tplite/src/resolve_dep.py`, and the stage timings and memory of its run
+report are collected. `util.get_file_info` is timed on the C sources of the
+corpus by `bench_parser.py`, when tree-sitter and the prebuilt grammars are
+available. Results are
+written as json tagged with the commit, and `--compare` flags the metrics
+that regressed against an earlier result file.
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_parser import SKIP_EXIT
+from gen_corpus import SCALES, generate_corpus
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+RESOLVE_DEP = ROOT_DIR.joinpath("tplite", "src", "resolve_dep.py")
+BENCH_PARSER = Path(__file__).resolve().parent.joinpath("bench_parser.py")
+
+
+def parameter_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"],
+                        choices=sorted(SCALES), help="corpus sizes to run")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per scale, the median is reported")
+    parser.add_argument("--cpu", type=int, default=4,
+                        help="--cpu of resolve_dep")
+    parser.add_argument("--c_files", type=int, default=None,
+                        help="C files of the parser benchmark at every scale, "
+                             "instead of the scale's own, 0 to skip it")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--resolve_args", nargs=argparse.REMAINDER, default=[],
+                        help="extra arguments of resolve_dep, e.g. --mem_budget 64")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative change reported as a regression")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def median_runs(runs):
+    '''Median of every numeric metric over the runs'''
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def bench_resolve(corpus_dir, cpu, repeat, extra_args):
+    '''Run resolve_dep on a corpus, return the metrics of each run'''
+    runs = []
+    for _ in range(repeat):
+        store_path = Path(tempfile.mkdtemp(prefix="tplite_bench_"))
+        try:
+            start = time.perf_counter()
+            proc = subprocess.run([
+                sys.executable, str(RESOLVE_DEP),
+                "--tpl_sigs", str(corpus_dir.joinpath("func_sigs")),
+                "--tpl_name", str(corpus_dir.joinpath("tpls_name.csv")),
+                "--store_path", str(store_path),
+                "--cpu", str(cpu),
+            ] + extra_args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            wall = time.perf_counter() - start
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stderr.decode(errors="replace"))
+                raise RuntimeError(f"resolve_dep failed on {corpus_dir}")
+            with open(store_path.joinpath("run_report.json")) as fp:
+                report = json.load(fp)
+        finally:
+            shutil.rmtree(store_path, ignore_errors=True)
+        metrics = {
+            "wall": wall,
+            "rss_peak_mb": report["rss_peak"] / 2 ** 20,
+            "children_rss_peak_mb": report["children_rss_peak"] / 2 ** 20,
+            "functions_per_sec": report["counters"].get("functions", 0) / wall,
+        }
+        for stage in report["stages"]:
+            metrics[f"{stage['name']}.wall"] = stage["wall"]
+            metrics[f"{stage['name']}.rss_peak_mb"] = stage["rss_peak"] / 2 ** 20
+        runs.append(metrics)
+    return runs
+
+
+def bench_parser(c_dir, repeat):
+    '''Run bench_parser.py on the C sources, None if it cannot run'''
+    runs = []
+    for _ in range(repeat):
+        report_dir = Path(tempfile.mkdtemp(prefix="tplite_bench_"))
+        try:
+            proc = subprocess.run([
+                sys.executable, str(BENCH_PARSER),
+                "--c_dir", str(c_dir),
+                "--report", str(report_dir.joinpath("run_report.json")),
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if proc.returncode == SKIP_EXIT:
+                logger.warning(proc.stderr.decode(errors="replace").strip())
+                return None
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stderr.decode(errors="replace"))
+                raise RuntimeError(f"bench_parser failed on {c_dir}")
+            with open(report_dir.joinpath("run_report.json")) as fp:
+                report = json.load(fp)
+        finally:
+            shutil.rmtree(report_dir, ignore_errors=True)
+        wall = report["stages"][0]["wall"]
+        counters = report["counters"]
+        runs.append({
+            "wall": wall,
+            "rss_peak_mb": report["rss_peak"] / 2 ** 20,
+            "files_per_sec": counters["files"] / wall,
+            "mb_per_sec": counters["bytes"] / 2 ** 20 / wall,
+            "functions_per_sec": counters["functions"] / wall,
+            "parse": report["cost"]["parser"]["parse"],
+            "hash": report["cost"]["parser"]["hash"],
+        })
+    return runs
+
+
+# metrics where a larger value is an improvement
+HIGHER_IS_BETTER = ("_per_sec",)
+# stages shorter than this are timer noise
+MIN_WALL = 0.05
+
+
+def compare(results, baseline, tolerance):
+    '''Log the relative change of each metric, return the regressions'''
+    regressions = []
+    for bench, metrics in results["benchmarks"].items():
+        base_metrics = baseline["benchmarks"].get(bench, {})
+        for key, value in metrics.items():
+            base = base_metrics.get(key)
+            if not base or (key.endswith("wall") and max(base, value) < MIN_WALL):
+                continue
+            change = (value - base) / base
+            worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            logger.info(f"{bench:>16} {key:<32} {base:>12.4f} -> {value:>12.4f} "
+                        f"({change:+.1%}) {flag}")
+            if flag:
+                regressions.append((bench, key, base, value))
+    return regressions
+
+
+def main():
+    results = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {k: (str(v) if isinstance(v, Path) else v)
+                   for k, v in vars(args).items()},
+        "benchmarks": dict(),
+    }
+    work_dir = Path(tempfile.mkdtemp(prefix="tplite_corpus_"))
+    parser_runs = True
+    try:
+        for scale in args.scales:
+            corpus_dir = work_dir.joinpath(scale)
+            params = dict(SCALES[scale])
+            if args.c_files is not None:
+                params["c_files"] = args.c_files
+            logger.info(f"[+] generate the {scale} corpus")
+            generate_corpus(corpus_dir, seed=args.seed, **params)
+            logger.info(f"[+] resolve the {scale} corpus")
+            runs = bench_resolve(corpus_dir, args.cpu, args.repeat, args.resolve_args)
+            results["benchmarks"][f"resolve_{scale}"] = median_runs(runs)
+
+            if params["c_files"] and parser_runs:
+                logger.info(f"[+] parse the {scale} corpus")
+                runs = bench_parser(corpus_dir.joinpath("c_src"), args.repeat)
+                if runs is None:
+                    parser_runs = False
+                else:
+                    results["benchmarks"][f"get_file_info_{scale}"] = median_runs(runs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or Path(__file__).resolve().parent.joinpath(
+        "results", f"{results['commit']}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as fp:
+        json.dump(results, fp, indent=1)
+    logger.info(f"[*] results: {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        logger.info(f"[+] compare {baseline['commit']} -> {results['commit']}")
+        if len(compare(results, baseline, args.tolerance)):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = parameter_parser()
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding=utf-8
+'''
+Persistent cache of the tpl repositories.
+
+Each tpl is mirrored once into `<cache>/<tpl_id>` and only fetched again on
+later runs. Mirrors track tags only (no branches) and are blobless where the
+remote supports partial clone, blobs are fetched lazily on tag checkout.
+A new mirror is built in a temporary sibling directory and moved into place
+after its first fetch, so an interrupted clone never looks reusable.
+'''
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+logger = logging.getLogger('main')
+
+TAG_REFSPEC = "+refs/tags/*:refs/tags/*"
+# the partial clone filter is silently ignored by remotes without support
+FETCH_ARGS = ["fetch", "--tags", "--force", "--prune", "--prune-tags",
+              "--filter=blob:none", "--no-recurse-submodules", "origin"]
+TAG_LOG_ARGS = ["log", "--tags", "--simplify-by-decoration",
+                "--pretty=format:%ai %d"]
+# written into a mirror once its first fetch succeeded
+MIRROR_MARKER = "tplite-mirror"
+
+
+def mirror_path(cache_dir, tpl_id):
+    return Path(cache_dir).joinpath(str(tpl_id))
+
+
+def is_mirror(path):
+    '''Whether the path holds a complete mirror of this cache'''
+    return Path(path).joinpath(".git", MIRROR_MARKER).exists()
+
+
+def sync_commands(url, path):
+    '''Git commands bringing the mirror at `path` up to date with `url`'''
+    path = str(path)
+    if is_mirror(path):
+        # the url of a tpl may have changed since the mirror was made
+        return [
+            ["git", "-C", path, "remote", "set-url", "origin", url],
+            ["git", "-C", path] + FETCH_ARGS,
+        ]
+    return [
+        ["git", "init", "--quiet", path],
+        ["git", "-C", path, "remote", "add", "origin", url],
+        ["git", "-C", path, "config", "remote.origin.fetch", TAG_REFSPEC],
+        ["git", "-C", path] + FETCH_ARGS,
+    ]
+
+
+def parse_tag_time(data_result):
+    '''Map tag names to their commit time from the `TAG_LOG_ARGS` output'''
+    tag_time = {}
+    for tag_info in data_result.split('\n'):
+        m = re.match(r".*tag: (?P<tag_name>.*)[),]", tag_info)
+        if m is None:
+            continue
+        tag_time[
+            m.groupdict()['tag_name'].split(',')[0]
+        ] = " ".join(tag_info.split()[:2])
+    return tag_time
+
+
+def reset_mirror(path):
+    '''Drop the directories left behind by an interrupted initialization'''
+    path = Path(path)
+    if path.exists() and not is_mirror(path):
+        logger.warning("[*] remove the stale clone: %s" % path)
+        shutil.rmtree(path)
+    for tmp_path in path.parent.glob(".%s.*" % path.name):
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def sync_repo(url, path):
+    '''Create or update the mirror of one repository'''
+    path = Path(path)
+    reset_mirror(path)
+    if is_mirror(path):
+        for command in sync_commands(url, path):
+            subprocess.check_output(command, stderr=subprocess.STDOUT)
+        return path
+    tmp_path = tempfile.mkdtemp(prefix=".%s." % path.name, dir=path.parent)
+    try:
+        for command in sync_commands(url, tmp_path):
+            subprocess.check_output(command, stderr=subprocess.STDOUT)
+        Path(tmp_path).joinpath(".git", MIRROR_MARKER).touch()
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def sync_repos(repos, cache_dir, jobs=4):
+    '''
+    Mirror `(tpl_id, url)` pairs with at most `jobs` concurrent fetches.
+    Yield `(tpl_id, path, error)` as soon as each fetch finishes, so the
+    caller can parse one repository while the others are still fetching.
+    '''
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(sync_repo, url, mirror_path(cache_dir, tpl_id)): tpl_id
+            for tpl_id, url in repos
+        }
+        for future in as_completed(futures):
+            tpl_id = futures[future]
+            path = mirror_path(cache_dir, tpl_id)
+            try:
+                future.result()
+            except subprocess.CalledProcessError as e:
+                yield tpl_id, path, e.output.decode(errors='ignore').strip()
+            else:
+                yield tpl_id, path, None
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 # coding=utf-8
 import argparse
-import re
+import asyncio
 import subprocess
-from util import is_test_file, is_source_file, is_header_file, is_c_extension, parse_files_with_tag
+import time
+from clone_cache import TAG_LOG_ARGS, parse_tag_time, sync_repos
+from grammar import build_languages
+from pipeline import ExtractionPipeline
+from util import collect_tasks, parse_files_with_tag
 import json
 import logging
 import os
@@ -13,13 +17,15 @@ import pandas as pd
 from pathlib import Path
 
 sys.path.append(os.getcwd())
+# the instrumentation is shared with tplite
+sys.path.append(str(Path(__file__).resolve().parents[1].joinpath("tplite", "src")))
+from profiling import RunReport, start_profiler  # noqa: E402
 
 
-current_path = os.getcwd()
-clone_path = current_path + "/repos/"
-
 logger = logging.getLogger('main')
-func_dict = {}
+clone_path = Path("./repos/")
+fetch_jobs = 4
+report = RunReport("extract_func")
 
 
 def valid_path(path: str) -> Path:
@@ -38,87 +44,117 @@ def parameter_parser():
                         default="./data/input/tpls_1k_url.csv")
     parser.add_argument("--output", type=valid_path,
                         default="./data/func_sigs/")
+    parser.add_argument("--clone_cache", type=Path, default="./repos/",
+                        help="directory of the persistent repository mirrors")
+    parser.add_argument("--fetch_jobs", type=int, default=4,
+                        help="number of concurrent repository fetches")
+    parser.add_argument("--parse_jobs", type=int, default=os.cpu_count(),
+                        help="number of tree-sitter parsing processes")
+    parser.add_argument("--queue_size", type=int, default=256,
+                        help="max number of files waiting to be parsed")
+    parser.add_argument("--sequential", action="store_true",
+                        help="parse the repositories one by one in this process")
+    parser.add_argument("--report", type=Path, default=None,
+                        help="path of the json run report, not written if unset "
+                             "(keep it out of --output)")
+    parser.add_argument("--profile", choices=["cprofile", "sample"], default=None,
+                        help="profile the run with cProfile or a stack sampler")
+    parser.add_argument("--profile_out", type=str, default=None,
+                        help="path of the profile (default: next to the report)")
     return parser.parse_args()
 
 
-def get_repo(url_file, save_dir, noheader=True):
-    df = pd.read_csv(url_file, names=["tpl_id", "url"], header=0)
-    os.chdir(clone_path)
+def git_output(args, repo_path):
+    return subprocess.check_output(
+        ["git"] + args, cwd=repo_path, stderr=subprocess.STDOUT
+    ).decode(errors='ignore')
+
 
+def pending_repos(url_file, save_dir):
+    df = pd.read_csv(url_file, names=["tpl_id", "url"], header=0)
     for tpl_id, url in zip(df["tpl_id"], df["url"]):
-        save_path = os.path.join(save_dir, f"{tpl_id}.json")
-        if os.path.exists(save_path):
+        if os.path.exists(os.path.join(save_dir, f"{tpl_id}.json")):
             continue
-        repo_name = url.split('/')[-1].replace(".git", "")
-        logging.info("Parsing %s" % repo_name)
-        clone_command = "git clone " + url
-        clone_result = subprocess.check_output(
-            clone_command, stderr=subprocess.STDOUT, shell=True
-        ).decode()
-        repo_path = clone_path + repo_name
-        os.chdir(repo_path)
-
-        tag_command = "git tag"
-        tag_result = subprocess.check_output(
-            tag_command, stderr=subprocess.STDOUT, shell=True
-        ).decode()
-
-        data_command = 'git log --tags --simplify-by-decoration --pretty="format:%ai %d"'
-        data_result = subprocess.check_output(
-            data_command, stderr=subprocess.STDOUT, shell=True
-        ).decode()
-        tag_time = {}
-        for tag_info in data_result.split('\n'):
-            m = re.match(r".*tag: (?P<tag_name>.*)[),]", tag_info)
-            tag_time[
-                m.groupdict()['tag_name'].split(',')[0]
-            ] = " ".join(tag_info.split()[:2])
-        print(tag_time)
+        yield tpl_id, url
+
+
+def get_repo(url_file, save_dir, noheader=True):
+    repos = list(pending_repos(url_file, save_dir))
+    for tpl_id, repo_path, error in sync_repos(repos, clone_path, fetch_jobs):
+        if error is not None:
+            logger.fatal('[*] Error: fetch %s failed: %s' % (tpl_id, error))
+            continue
+        save_path = os.path.join(save_dir, f"{tpl_id}.json")
+        logging.info("Parsing %s" % tpl_id)
+        func_dict = {}
+        cost = {"git": 0.0, "parse": 0.0, "hash": 0.0,
+                "tags": 0, "files": 0, "functions": 0}
         try:
+            start = time.perf_counter()
+            tag_result = git_output(["tag"], repo_path)
+            tag_time = parse_tag_time(git_output(TAG_LOG_ARGS, repo_path))
+            cost["git"] += time.perf_counter() - start
+            print(tag_time)
             if tag_result != "":
                 for tag in str(tag_result).split('\n'):
                     if tag == '':
                         continue
                     print("tag: ", tag)
-                    checkout_command = "git checkout -f " + tag
-                    subprocess.check_output(
-                        checkout_command, stderr=subprocess.STDOUT, shell=True)
-                    tasks, rel_paths = [], []
-                    for root, _, files in os.walk(repo_path, topdown=False):
-                        for name in files:
-                            file_path = os.path.join(root, name)
-                            file_path_rel = os.path.relpath(
-                                file_path, repo_path)
-                            if is_test_file(file_path_rel):
-                                continue
-                            if (
-                                is_source_file(name) or
-                                (not noheader and is_header_file(name))
-                            ) and not is_test_file(name):
-                                tasks.append((
-                                    file_path,
-                                    not is_c_extension(name),
-                                    file_path_rel
-                                ))
-                                rel_paths.append(file_path_rel)
-                    parse_files_with_tag(tasks, tag, tag_time[tag], func_dict)
+                    cost["tags"] += 1
+                    start = time.perf_counter()
+                    git_output(["checkout", "-f", tag], repo_path)
+                    cost["git"] += time.perf_counter() - start
+                    tasks = collect_tasks(str(repo_path), noheader)
+                    parse_files_with_tag(
+                        tasks, tag, tag_time[tag], func_dict, cost
+                    )
             else:
                 print("TODO - for repository with only master")
         except Exception as e:
             logger.fatal('[*] Error: %s' % str(e))
         with open(save_path, 'w') as fp:
             json.dump(func_dict, fp, indent=1)
-    os.chdir(current_path)
+        report.record("repos", tpl_id, cost)
+        report.count("repos")
+        report.count("files", cost["files"])
+        report.count("functions", cost["functions"])
 
 
 def main():
-    os.mkdir(clone_path)
-    get_repo(
-        args.tpls_url,
-        args.output
+    global clone_path, fetch_jobs
+    with report.stage("build_grammars"):
+        build_languages()
+    clone_path = args.clone_cache
+    fetch_jobs = args.fetch_jobs
+    if args.sequential:
+        with report.stage("extract"):
+            get_repo(
+                args.tpls_url,
+                args.output
+            )
+        return
+    pipeline = ExtractionPipeline(
+        args.output,
+        clone_path,
+        git_jobs=fetch_jobs,
+        parse_jobs=args.parse_jobs,
+        queue_size=args.queue_size,
+        report=report
     )
+    with report.stage("extract"):
+        asyncio.run(pipeline.run(list(pending_repos(args.tpls_url, args.output))))
 
 
 if __name__ == "__main__":
     args = parameter_parser()
-    main()
+    report.start()
+    stop_profiler = start_profiler(
+        args.profile,
+        args.profile_out or f"{args.report or 'extract_func'}.{args.profile}"
+    )
+    try:
+        main()
+    finally:
+        stop_profiler()
+        if args.report is not None:
+            report.dump(args.report)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# coding=utf-8
+'''
+Build and locate the compiled tree-sitter grammars.
+
+Compiling the vendored grammars is an explicit one-time step
+(`python extractor/grammar.py`). The shared library is cached under a
+directory keyed by the vendor grammar commits, so importing the extractor
+only loads an existing `.so` and never invokes the compiler.
+'''
+import argparse
+import logging
+import os
+import subprocess
+import tempfile
+from functools import lru_cache
+from hashlib import sha256
+from pathlib import Path
+
+logger = logging.getLogger('main')
+
+BASE_DIR = Path(__file__).resolve().parent
+VENDOR_DIR = BASE_DIR.joinpath("vendor")
+GRAMMARS = ["tree-sitter-cpp", "tree-sitter-c"]
+CACHE_DIR = Path(os.environ.get(
+    "TPLITE_GRAMMAR_CACHE", BASE_DIR.joinpath("build", "grammars")
+))
+LIBRARY_NAME = "languages.so"
+
+
+def grammar_revision(grammar_path):
+    '''Commit hash of a vendored grammar, or a content hash outside git'''
+    try:
+        toplevel, revision = subprocess.check_output(
+            ["git", "rev-parse", "--show-toplevel", "HEAD"],
+            cwd=grammar_path, stderr=subprocess.DEVNULL
+        ).decode().splitlines()
+        # git walks up to an enclosing repository, whose commit says
+        # nothing about the grammar sources
+        if Path(toplevel).resolve() == Path(grammar_path).resolve():
+            return revision
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        pass
+    # e.g. a source tarball without the submodule metadata
+    digest = sha256()
+    for src in sorted(Path(grammar_path).joinpath("src").glob("*.c*")):
+        digest.update(src.name.encode())
+        digest.update(src.read_bytes())
+    return digest.hexdigest()
+
+
+def tree_sitter_version():
+    try:
+        from importlib.metadata import version
+        return version("tree_sitter")
+    except Exception:
+        return "unknown"
+
+
+@lru_cache(maxsize=None)
+def grammar_fingerprint(vendor_dir=VENDOR_DIR):
+    '''Cache key derived from the grammar commits and the binding version,
+    computed once per process as it runs `git` for each grammar'''
+    digest = sha256()
+    digest.update(("tree_sitter:%s\n" % tree_sitter_version()).encode())
+    for name in GRAMMARS:
+        revision = grammar_revision(Path(vendor_dir).joinpath(name))
+        digest.update(("%s:%s\n" % (name, revision)).encode())
+    return digest.hexdigest()[:16]
+
+
+def library_path(vendor_dir=VENDOR_DIR, cache_dir=CACHE_DIR):
+    return Path(cache_dir).joinpath(grammar_fingerprint(vendor_dir), LIBRARY_NAME)
+
+
+def build_languages(vendor_dir=VENDOR_DIR, cache_dir=CACHE_DIR, force=False):
+    '''Compile the grammars into the cache unless they are already built'''
+    from tree_sitter import Language
+
+    so_path = library_path(vendor_dir, cache_dir)
+    if so_path.exists() and not force:
+        logger.info("[+] grammar library cached: %s" % so_path)
+        return so_path
+    so_path.parent.mkdir(parents=True, exist_ok=True)
+    logger.info("[+] build the grammar library: %s" % so_path)
+    # build aside and rename, concurrent builders never see a partial file
+    fd, tmp_path = tempfile.mkstemp(suffix=".so", dir=so_path.parent)
+    os.close(fd)
+    try:
+        os.remove(tmp_path)
+        Language.build_library(
+            tmp_path,
+            [str(Path(vendor_dir).joinpath(name)) for name in GRAMMARS]
+        )
+        os.replace(tmp_path, so_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return so_path
+
+
+def cached_library(vendor_dir=VENDOR_DIR, cache_dir=CACHE_DIR):
+    '''Path of the prebuilt grammar library, it is never compiled here'''
+    so_path = library_path(vendor_dir, cache_dir)
+    if not so_path.exists():
+        raise FileNotFoundError(
+            f"{so_path} not exist, build it with `python {__file__}`"
+        )
+    return so_path
+
+
+def parameter_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vendor", type=Path, default=VENDOR_DIR,
+                        help="directory of the vendored tree-sitter grammars")
+    parser.add_argument("--cache", type=Path, default=CACHE_DIR,
+                        help="directory of the grammar library cache")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild even if the library is cached")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parameter_parser()
+    print(build_languages(args.vendor, args.cache, args.force))
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# coding=utf-8
+'''
+Asynchronous extraction pipeline.
+
+Git commands run as asyncio subprocesses in `git_jobs` concurrent workers,
+each of which checks out the tags of one repository and puts the source
+files on a bounded queue. `parse_jobs` workers feed the queue to a process
+pool running tree-sitter. A full queue blocks the git stage, so at most
+`queue_size` file contents are held in memory at any time.
+'''
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from clone_cache import TAG_LOG_ARGS, mirror_path, parse_tag_time, sync_repo
+from util import add_functions, collect_tasks, extract_functions_timed
+
+logger = logging.getLogger('main')
+
+# times a file is resubmitted after the pool died under it
+MAX_POOL_RETRIES = 2
+
+
+async def run_git(command, cwd=None):
+    '''Run a git command line and return its decoded output'''
+    proc = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    output, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command, output)
+    return output.decode(errors='ignore')
+
+
+async def in_thread(func, *args):
+    '''Run blocking file system work off the event loop'''
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def read_file(location):
+    with open(location, 'rb') as fp:
+        return fp.read()
+
+
+class RepoState:
+    '''Functions of one tpl collected across the parse workers'''
+
+    def __init__(self, tpl_id, save_path):
+        self.tpl_id = tpl_id
+        self.save_path = save_path
+        self.func_dict = {}
+        self.pending = 0        # files queued or being parsed
+        self.checked_out = False  # all tags have been queued
+        # parse results are merged in queue order, as the sequential driver
+        # does, so the source and path kept for a hash are deterministic
+        self.queued = 0
+        self.merged = 0
+        self.parsed = {}
+        # a file was lost to a dead worker, the signature would be incomplete
+        self.lost = False
+        # seconds per step and item counts, reported per repository
+        self.cost = {"fetch": 0.0, "git": 0.0, "read": 0.0, "parse": 0.0,
+                     "hash": 0.0, "tags": 0, "files": 0, "functions": 0}
+
+    @contextmanager
+    def timed(self, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.cost[step] += time.perf_counter() - start
+
+    def merge(self, seq, funcs, tag, tag_time, rel_path):
+        '''Add the functions of file `seq` once all earlier files are added'''
+        self.parsed[seq] = (funcs, tag, tag_time, rel_path)
+        while self.merged in self.parsed:
+            funcs, tag, tag_time, rel_path = self.parsed.pop(self.merged)
+            add_functions(self.func_dict, funcs, tag, tag_time, rel_path)
+            self.merged += 1
+
+
+class ExtractionPipeline:
+    def __init__(self, save_dir, clone_cache, git_jobs=4, parse_jobs=None,
+                 queue_size=256, noheader=True, report_interval=30,
+                 report=None):
+        self.save_dir = save_dir
+        self.clone_cache = clone_cache
+        self.git_jobs = max(git_jobs, 1)
+        self.parse_jobs = max(parse_jobs or os.cpu_count(), 1)
+        self.queue_size = queue_size
+        self.noheader = noheader
+        self.report_interval = report_interval
+        self.report = report
+        self.git_active = 0
+        self.parse_active = 0
+        self.repos_done = 0
+        # seconds the stages spent blocked on each other
+        self.git_blocked = 0.0
+        self.parse_starved = 0.0
+
+    def queue_depths(self):
+        '''
+        Per-stage depths. A full `files_queued` with a growing `git_blocked`
+        means parsing is the bottleneck, a growing `parse_starved` means git.
+        '''
+        return {
+            "repos_waiting": self.repo_queue.qsize(),
+            "git_active": self.git_active,
+            "files_queued": self.file_queue.qsize(),
+            "parse_active": self.parse_active,
+            "repos_done": self.repos_done,
+            "git_blocked": round(self.git_blocked, 1),
+            "parse_starved": round(self.parse_starved, 1),
+        }
+
+    async def run(self, repos):
+        '''Extract the signatures of `(tpl_id, url)` pairs'''
+        os.makedirs(self.clone_cache, exist_ok=True)
+        self.repo_queue = asyncio.Queue()
+        self.file_queue = asyncio.Queue(maxsize=self.queue_size)
+        for repo in repos:
+            self.repo_queue.put_nowait(repo)
+
+        self.executor = ProcessPoolExecutor(self.parse_jobs)
+        try:
+            parsers = [asyncio.create_task(self.parse_worker())
+                       for _ in range(self.parse_jobs)]
+            monitor = asyncio.create_task(self.monitor())
+            await asyncio.gather(*[self.git_worker()
+                                   for _ in range(self.git_jobs)])
+            await self.file_queue.join()
+            for task in parsers + [monitor]:
+                task.cancel()
+            await asyncio.gather(*parsers, monitor, return_exceptions=True)
+        finally:
+            self.executor.shutdown()
+        logger.info("[+] extraction finished: %s" % self.queue_depths())
+        if self.report is not None:
+            self.report.snapshot(self.queue_depths())
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            logger.info("[+] pipeline: %s" % self.queue_depths())
+            if self.report is not None:
+                self.report.snapshot(self.queue_depths())
+
+    async def git_worker(self):
+        while not self.repo_queue.empty():
+            tpl_id, url = self.repo_queue.get_nowait()
+            self.git_active += 1
+            try:
+                await self.checkout_repo(tpl_id, url)
+            finally:
+                self.git_active -= 1
+
+    async def checkout_repo(self, tpl_id, url):
+        repo_path = str(mirror_path(self.clone_cache, tpl_id))
+        state = RepoState(
+            tpl_id, os.path.join(self.save_dir, f"{tpl_id}.json")
+        )
+        try:
+            with state.timed("fetch"):
+                # the same routine as the sequential driver, in a thread
+                await in_thread(sync_repo, url, repo_path)
+        except subprocess.CalledProcessError as e:
+            logger.fatal('[*] Error: fetch %s failed: %s' % (
+                tpl_id, e.output.decode(errors='ignore').strip()))
+            if self.report is not None:
+                self.report.count("repos_failed")
+            return
+
+        logging.info("Parsing %s" % tpl_id)
+        try:
+            with state.timed("git"):
+                tag_result = await run_git(["git", "tag"], repo_path)
+                tag_time = parse_tag_time(
+                    await run_git(["git"] + TAG_LOG_ARGS, repo_path)
+                )
+            if tag_result == "":
+                logger.info("TODO - for repository with only master")
+            for tag in tag_result.split('\n'):
+                if tag == '':
+                    continue
+                state.cost["tags"] += 1
+                with state.timed("git"):
+                    await run_git(["git", "checkout", "-f", tag], repo_path)
+                with state.timed("read"):
+                    tasks = await in_thread(
+                        collect_tasks, repo_path, self.noheader
+                    )
+                for location, iscpp, rel_path in tasks:
+                    # the worktree moves on once the contents are read
+                    with state.timed("read"):
+                        file_cont = await in_thread(read_file, location)
+                    state.pending += 1
+                    start = time.monotonic()
+                    await self.file_queue.put((
+                        state, state.queued, tag, tag_time[tag], rel_path,
+                        file_cont, iscpp
+                    ))
+                    state.queued += 1
+                    self.git_blocked += time.monotonic() - start
+        except Exception as e:
+            logger.fatal('[*] Error: %s' % str(e))
+        state.checked_out = True
+        await self.finish_repo(state)
+
+    async def parse_file(self, file_cont, iscpp):
+        '''
+        Parse in the pool, replacing it when a worker died. Every file in
+        flight fails with the pool, so each of them is resubmitted.
+        '''
+        loop = asyncio.get_running_loop()
+        for retry in range(MAX_POOL_RETRIES + 1):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(
+                    executor, extract_functions_timed, file_cont, iscpp
+                )
+            except BrokenProcessPool:
+                if retry == MAX_POOL_RETRIES:
+                    raise
+                # the first worker to notice replaces the pool
+                if self.executor is executor:
+                    logger.fatal('[*] Error: a parse worker died, restart the pool')
+                    executor.shutdown(wait=False)
+                    self.executor = ProcessPoolExecutor(self.parse_jobs)
+
+    async def parse_worker(self):
+        while True:
+            start = time.monotonic()
+            item = await self.file_queue.get()
+            self.parse_starved += time.monotonic() - start
+            state, seq, tag, tag_time, rel_path, file_cont, iscpp = item
+            self.parse_active += 1
+            funcs = []
+            try:
+                funcs, parse_time, hash_time = await self.parse_file(file_cont, iscpp)
+                state.cost["parse"] += parse_time
+                state.cost["hash"] += hash_time
+                state.cost["files"] += 1
+                state.cost["functions"] += len(funcs)
+            except BrokenProcessPool:
+                logger.fatal('[*] Error: %s: lost to a dead parse worker' % rel_path)
+                state.lost = True
+            except Exception as e:
+                logger.fatal('[*] Error: %s: %s' % (rel_path, str(e)))
+            finally:
+                # a failed file still advances the merge
+                state.merge(seq, funcs, tag, tag_time, rel_path)
+                self.parse_active -= 1
+                state.pending -= 1
+                await self.finish_repo(state)
+                self.file_queue.task_done()
+
+    async def finish_repo(self, state):
+        '''Dump the signature once every file of the tpl has been parsed'''
+        if not state.checked_out or state.pending > 0:
+            return
+        if state.lost:
+            # no json, so the next run extracts the tpl again
+            logger.fatal('[*] Error: %s not saved, files were lost' % state.tpl_id)
+            if self.report is not None:
+                self.report.count("repos_failed")
+            return
+        await in_thread(dump_signature, state.save_path, state.func_dict)
+        self.repos_done += 1
+        if self.report is not None:
+            self.report.record("repos", state.tpl_id, state.cost)
+            self.report.count("repos")
+            self.report.count("files", state.cost["files"])
+            self.report.count("functions", state.cost["functions"])
+
+
+def dump_signature(save_path, func_dict):
+    with open(save_path, 'w') as fp:
+        json.dump(func_dict, fp, indent=1)
@@ -3,18 +3,17 @@ import os
 import tlsh
 import logging
 from hashlib import sha256
+from time import perf_counter
 from tqdm import tqdm
 from tree_sitter import Language, Parser
+from grammar import cached_library
 
 logger = logging.getLogger('main')
 
-Language.build_library(
-    'build/my-languages.so',
-    [
-        'vendor/tree-sitter-cpp',
-        'vendor/tree-sitter-c'
-    ]
-)
+# loaded languages per process, keyed by (library path, language name)
+_languages = {}
+# default grammar library, resolved on the first load
+_library = None
 
 '''
 In general, these paths won't contain codes that will be compiled into the binary.
@@ -144,12 +143,75 @@ def computeTlsh(string):
     return hs
 
 
+def load_language(name, so_path=None):
+    '''Load a language from the prebuilt grammar library once per process'''
+    global _library
+    if so_path is None:
+        if _library is None:
+            _library = cached_library()
+        so_path = _library
+    key = (str(so_path), name)
+    if key not in _languages:
+        _languages[key] = Language(str(so_path), name)
+    return _languages[key]
+
+
 def is_similar(func_hash, func_hash_compare, cut_off=30):
     distance = int(tlsh.diffxlen(func_hash, func_hash_compare))
     return distance <= cut_off and distance > 0
 
 
-def parse_files_with_tag(tasks, tag, time, func_dict):
+def extract_functions_timed(file_cont, iscpp):
+    '''
+    Return the (normalized sha256, source) of every function in a file,
+    along with the parsing and hashing seconds
+    '''
+    start = perf_counter()
+    file_info = get_file_info(
+        file_cont,
+        iscpp
+    )
+    parsed = perf_counter()
+    funcs = []
+    for function in file_info['functions']:
+        clean_src = normalize(
+            get_code_line_after_clean(function['src'])[0]
+        ).encode('utf-8')
+        funcs.append((sha256(clean_src).hexdigest(), function['src']))
+    return funcs, parsed - start, perf_counter() - parsed
+
+
+def add_functions(func_dict, funcs, tag, time, rel_path):
+    for func_hash, func_src in funcs:
+        if func_hash not in func_dict:
+            func_dict[func_hash] = [func_src, dict()]
+        tag_dict = func_dict[func_hash][1]
+        tag_dict[tag] = [time, rel_path]
+
+
+def collect_tasks(repo_path, noheader=True):
+    '''List the (location, iscpp, rel_path) of the files to parse'''
+    tasks = []
+    for root, _, files in os.walk(repo_path, topdown=False):
+        for name in files:
+            file_path = os.path.join(root, name)
+            file_path_rel = os.path.relpath(file_path, repo_path)
+            if is_test_file(file_path_rel):
+                continue
+            if (
+                is_source_file(name) or
+                (not noheader and is_header_file(name))
+            ) and not is_test_file(name):
+                tasks.append((
+                    file_path,
+                    not is_c_extension(name),
+                    file_path_rel
+                ))
+    return tasks
+
+
+def parse_files_with_tag(tasks, tag, time, func_dict, cost=None):
+    '''Parse the files of a tag, accumulating the seconds spent in `cost`'''
     json_cache = None
     ret = []
     for location, iscpp, rel_path in tqdm(tasks, total=len(tasks)):
@@ -161,20 +223,15 @@ def parse_files_with_tag(tasks, tag, time, func_dict):
             ret.append(json_cache[file_hash])
         else:
             try:
-                file_info = get_file_info(
-                    file_cont,
-                    iscpp
+                funcs, parse_time, hash_time = extract_functions_timed(
+                    file_cont, iscpp
                 )
-                functions = file_info['functions']
-                for function in functions:
-                    clean_src = normalize(
-                        get_code_line_after_clean(function['src'])[0]
-                    ).encode('utf-8')
-                    func_hash = sha256(clean_src).hexdigest()
-                    if func_hash not in func_dict:
-                        func_dict[func_hash] = [function['src'], dict()]
-                    tag_dict = func_dict[func_hash][1]
-                    tag_dict[tag] = [time, rel_path]
+                add_functions(func_dict, funcs, tag, time, rel_path)
+                if cost is not None:
+                    cost["parse"] += parse_time
+                    cost["hash"] += hash_time
+                    cost["files"] += 1
+                    cost["functions"] += len(funcs)
             except Exception as e:
                 logger.fatal('[*] Error: %s' % str(e))
                 ret.append({'status': 0, 'sha256': file_hash})
@@ -303,13 +360,8 @@ def get_file_info(
     preproc_info=None,
     so_path=None
 ):
-    if so_path is None:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        c_language = Language('%s/build/my-languages.so' % base_dir, 'c')
-        cpp_language = Language('%s/build/my-languages.so' % base_dir, 'cpp')
-    else:
-        c_language = Language(so_path, 'c')
-        cpp_language = Language(so_path, 'cpp')
+    c_language = load_language('c', so_path)
+    cpp_language = load_language('cpp', so_path)
     parser_c = Parser()
     parser_c.set_language(c_language)
     parser_cpp = Parser()
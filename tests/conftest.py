@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+# the extractor, tplite and benchmark scripts import their siblings directly
+for src_dir in ["extractor", "tplite/src", "benchmarks"]:
+    sys.path.insert(0, str(ROOT_DIR.joinpath(src_dir)))
+
+
+def resolve_dep_cli(corpus_dir, store_path, *extra_args):
+    '''Run resolve_dep on a generated corpus, return its tpl_dep.csv'''
+    subprocess.check_call([
+        sys.executable, str(ROOT_DIR.joinpath("tplite", "src", "resolve_dep.py")),
+        "--tpl_sigs", str(corpus_dir.joinpath("func_sigs")),
+        "--tpl_name", str(corpus_dir.joinpath("tpls_name.csv")),
+        "--store_path", str(store_path),
+        "--cpu", "2",
+    ] + list(extra_args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return store_path.joinpath("tpl_dep.csv").read_bytes()
+
+
+@pytest.fixture(scope="session")
+def run_resolve_dep():
+    return resolve_dep_cli
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    from gen_corpus import generate_corpus
+    corpus_dir = tmp_path_factory.mktemp("corpus")
+    generate_corpus(corpus_dir, tpls=30, funcs=120, seed=1)
+    return corpus_dir
+
+
+@pytest.fixture(scope="session")
+def reference(corpus, tmp_path_factory):
+    '''tpl_dep.csv of the local backend, in memory'''
+    return resolve_dep_cli(corpus, tmp_path_factory.mktemp("reference"))
@@ -0,0 +1,146 @@
+import os
+import subprocess
+
+import clone_cache
+import pytest
+
+
+def git(*args, cwd=None, env=None):
+    return subprocess.check_output(
+        ["git", "-c", "user.name=tplite", "-c", "user.email=tplite@localhost",
+         "-c", "init.defaultBranch=master"] + list(args),
+        cwd=cwd, env=env, stderr=subprocess.STDOUT
+    ).decode()
+
+
+def commit_and_tag(work_dir, tag, date):
+    work_dir.joinpath("lib.c").write_text(f"int {tag.replace('.', '_')}(void) {{ return 0; }}\n")
+    git("add", "lib.c", cwd=work_dir)
+    git("commit", "--quiet", "-m", tag, cwd=work_dir,
+        env=dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date))
+    git("tag", tag, cwd=work_dir)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    '''A bare repository with two tags, and the work tree pushing to it'''
+    work_dir = tmp_path.joinpath("work")
+    bare = tmp_path.joinpath("remote.git")
+    git("init", "--quiet", str(work_dir))
+    commit_and_tag(work_dir, "v1.0", "2020-01-01T00:00:00 +0000")
+    commit_and_tag(work_dir, "v1.1", "2021-01-01T00:00:00 +0000")
+    git("clone", "--quiet", "--bare", str(work_dir), str(bare))
+    git("remote", "add", "origin", str(bare), cwd=work_dir)
+    return work_dir, "file://%s" % bare
+
+
+def tags(path):
+    return git("tag", cwd=path).split()
+
+
+def sync(repos, cache_dir):
+    return {tpl_id: (path, error)
+            for tpl_id, path, error in clone_cache.sync_repos(repos, cache_dir, jobs=2)}
+
+
+def test_first_clone(remote, tmp_path):
+    _, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    path, error = sync([("tpl", url)], cache_dir)["tpl"]
+    assert error is None
+    assert path == clone_cache.mirror_path(cache_dir, "tpl")
+    assert clone_cache.is_mirror(path)
+    assert tags(path) == ["v1.0", "v1.1"]
+    # tags only, no branch is tracked
+    assert git("branch", "-r", cwd=path).strip() == ""
+    tag_time = clone_cache.parse_tag_time(git(*clone_cache.TAG_LOG_ARGS, cwd=path))
+    assert tag_time == {"v1.0": "2020-01-01 00:00:00", "v1.1": "2021-01-01 00:00:00"}
+
+
+def test_refetch(remote, tmp_path):
+    work_dir, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    sync([("tpl", url)], cache_dir)
+    path = clone_cache.mirror_path(cache_dir, "tpl")
+    assert clone_cache.sync_commands(url, path)[-1] == \
+        ["git", "-C", str(path)] + clone_cache.FETCH_ARGS
+
+    commit_and_tag(work_dir, "v2.0", "2022-01-01T00:00:00 +0000")
+    git("push", "--quiet", "origin", "v2.0", cwd=work_dir)
+    git("push", "--quiet", "origin", ":refs/tags/v1.0", cwd=work_dir)
+    path, error = sync([("tpl", url)], cache_dir)["tpl"]
+    assert error is None
+    # new tags are fetched and deleted ones pruned
+    assert tags(path) == ["v1.1", "v2.0"]
+
+
+def test_stale_directory_is_replaced(remote, tmp_path):
+    _, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    stale = clone_cache.mirror_path(cache_dir, "tpl")
+    stale.mkdir(parents=True)
+    stale.joinpath("partial").write_text("left by an interrupted run")
+    path, error = sync([("tpl", url)], cache_dir)["tpl"]
+    assert error is None
+    assert not path.joinpath("partial").exists()
+    assert tags(path) == ["v1.0", "v1.1"]
+
+
+@pytest.mark.parametrize("steps", [1, 2, 3])
+def test_interrupted_first_clone(remote, tmp_path, steps):
+    '''A clone interrupted after git init, remote add or the refspec'''
+    _, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    path = clone_cache.mirror_path(cache_dir, "tpl")
+    cache_dir.mkdir()
+    for command in clone_cache.sync_commands(url, path)[:steps]:
+        subprocess.check_output(command)
+    tmp_clone = cache_dir.joinpath(".tpl.interrupted")
+    tmp_clone.mkdir()
+    assert not clone_cache.is_mirror(path)
+    path, error = sync([("tpl", url)], cache_dir)["tpl"]
+    assert error is None
+    assert tags(path) == ["v1.0", "v1.1"]
+    assert git("branch", "-r", cwd=path).strip() == ""
+    assert not tmp_clone.exists()
+
+
+def test_url_change_is_followed(remote, tmp_path):
+    _, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    missing = "file://%s" % tmp_path.joinpath("missing.git")
+    assert sync([("tpl", missing)], cache_dir)["tpl"][1]
+    # the url is corrected in the csv
+    path, error = sync([("tpl", url)], cache_dir)["tpl"]
+    assert error is None
+    assert tags(path) == ["v1.0", "v1.1"]
+
+    moved = tmp_path.joinpath("moved.git")
+    tmp_path.joinpath("remote.git").rename(moved)
+    path, error = sync([("tpl", "file://%s" % moved)], cache_dir)["tpl"]
+    assert error is None
+    assert git("remote", "get-url", "origin", cwd=path).strip() == "file://%s" % moved
+
+
+def test_failed_fetch(remote, tmp_path):
+    _, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    missing = "file://%s" % tmp_path.joinpath("missing.git")
+    result = sync([("tpl", url), ("gone", missing)], cache_dir)
+    assert result["tpl"][1] is None
+    path, error = result["gone"]
+    assert error
+    # a failed first clone leaves nothing behind
+    assert not path.exists()
+    assert [p.name for p in cache_dir.iterdir()] == ["tpl"]
+
+
+def test_failed_refetch_keeps_mirror(remote, tmp_path):
+    _, url = remote
+    cache_dir = tmp_path.joinpath("cache")
+    sync([("tpl", url)], cache_dir)
+    missing = "file://%s" % tmp_path.joinpath("missing.git")
+    path, error = sync([("tpl", missing)], cache_dir)["tpl"]
+    assert error
+    assert clone_cache.is_mirror(path)
+    assert tags(path) == ["v1.0", "v1.1"]
@@ -0,0 +1,25 @@
+from collections import Counter
+
+import pyarrow.parquet as pq
+import pytest
+from dep_output import edge_decision
+
+
+def test_decisions_match_dependencies(corpus, reference, run_resolve_dep, tmp_path):
+    store_path = tmp_path.joinpath("parquet")
+    assert run_resolve_dep(corpus, store_path, "--parquet") == reference
+    edges = pq.read_table(store_path.joinpath("tpl_edges.parquet")).to_pylist()
+    kept = {(edge["origin_tpl_uuid"], edge["reuse_tpl_uuid"])
+            for edge in edges if edge["decision"] == "kept"}
+    dependencies = {tuple(line.split(",")) for line in reference.decode().split()[1:]}
+    assert kept == dependencies
+    edge_funcs = pq.read_table(store_path.joinpath("tpl_edge_funcs.parquet"))
+    reuse_num = Counter(edge_funcs.column("edge_id").to_pylist())
+    for edge in edges:
+        assert reuse_num[edge["edge_id"]] == edge["reuse_num"]
+
+
+def test_unrecalled_edge_is_an_error():
+    evidence = {"bidirection": set(), "centrality": set()}
+    with pytest.raises(ValueError):
+        edge_decision(("s", "x"), {"x": 10}, 2, 0.5, 0.1, set(), evidence)
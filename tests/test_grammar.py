@@ -0,0 +1,70 @@
+import subprocess
+
+import grammar
+import pytest
+import util
+
+from test_clone_cache import git
+
+
+@pytest.fixture
+def count_subprocesses(monkeypatch):
+    calls = []
+    check_output = subprocess.check_output
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return check_output(*args, **kwargs)
+    monkeypatch.setattr(subprocess, "check_output", counted)
+    return calls
+
+
+def test_fingerprint_computed_once(count_subprocesses):
+    grammar.grammar_fingerprint.cache_clear()
+    for _ in range(50):
+        try:
+            grammar.cached_library()
+        except FileNotFoundError:
+            pass
+    assert len(count_subprocesses) <= len(grammar.GRAMMARS)
+
+
+def test_get_file_info_spawns_nothing_after_first_call(count_subprocesses):
+    try:
+        grammar.cached_library()
+    except FileNotFoundError:
+        pytest.skip("grammar library not built")
+    util.get_file_info(b"int f(int a) { return a; }")
+    count_subprocesses.clear()
+    file_info = util.get_file_info(b"int g(void) { return 1; }")
+    assert count_subprocesses == []
+    assert [func["name"] for func in file_info["functions"]] == ["g"]
+
+
+def make_grammar(path, source):
+    path.joinpath("src").mkdir(parents=True)
+    path.joinpath("src", "parser.c").write_text(source)
+
+
+def test_revision_of_own_checkout(tmp_path):
+    grammar_path = tmp_path.joinpath("tree-sitter-c")
+    make_grammar(grammar_path, "int parser;\n")
+    git("init", "--quiet", str(grammar_path))
+    git("add", "src", cwd=grammar_path)
+    git("commit", "--quiet", "-m", "grammar", cwd=grammar_path)
+    head = git("rev-parse", "HEAD", cwd=grammar_path).strip()
+    assert grammar.grammar_revision(grammar_path) == head
+
+
+def test_revision_inside_other_repository(tmp_path):
+    outer = tmp_path.joinpath("outer")
+    grammar_path = outer.joinpath("vendor", "tree-sitter-c")
+    make_grammar(grammar_path, "int parser;\n")
+    git("init", "--quiet", str(outer))
+    git("add", "vendor", cwd=outer)
+    git("commit", "--quiet", "-m", "vendor", cwd=outer)
+    revision = grammar.grammar_revision(grammar_path)
+    assert revision != git("rev-parse", "HEAD", cwd=outer).strip()
+    # edited sources change the key although the outer HEAD does not move
+    grammar_path.joinpath("src", "parser.c").write_text("int parser = 1;\n")
+    assert grammar.grammar_revision(grammar_path) != revision
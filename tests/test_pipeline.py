@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import grammar
+import pytest
+from clone_cache import TAG_LOG_ARGS, mirror_path, parse_tag_time
+from pipeline import ExtractionPipeline, RepoState
+from util import collect_tasks, parse_files_with_tag
+
+from test_clone_cache import commit_and_tag, git
+
+
+def test_merge_in_queue_order():
+    state = RepoState("tpl", None)
+    funcs = [("h", "int f(void) { return 0; }")]
+    # parsed in reverse order, the first queued file still wins
+    for seq in [2, 1, 0]:
+        state.merge(seq, funcs, "v1", "2020-01-01 00:00:00", f"src/file{seq}.c")
+        assert state.merged == (3 if seq == 0 else 0)
+    assert state.func_dict == {
+        "h": ["int f(void) { return 0; }",
+              {"v1": ["2020-01-01 00:00:00", "src/file2.c"]}]
+    }
+    assert state.parsed == {}
+
+
+@pytest.fixture
+def shared_remote(tmp_path):
+    '''Tags whose files share one function under different paths'''
+    work_dir = tmp_path.joinpath("work")
+    bare = tmp_path.joinpath("remote.git")
+    git("init", "--quiet", str(work_dir))
+    for i in range(40):
+        src = work_dir.joinpath("src", f"dir{i % 4}", f"file{i}.c")
+        src.parent.mkdir(parents=True, exist_ok=True)
+        src.write_text(
+            "int shared(int a)\n{\n    return a + 1;\n}\n\n"
+            f"int own{i}(void) {{ return {i}; }}\n" * (1 + i % 5)
+        )
+    git("add", ".", cwd=work_dir)
+    commit_and_tag(work_dir, "v1.0", "2020-01-01T00:00:00 +0000")
+    commit_and_tag(work_dir, "v1.1", "2021-01-01T00:00:00 +0000")
+    git("clone", "--quiet", "--bare", str(work_dir), str(bare))
+    return "file://%s" % bare
+
+
+def sequential_signature(repo_path):
+    func_dict = {}
+    tag_time = parse_tag_time(git(*TAG_LOG_ARGS, cwd=repo_path))
+    for tag in git("tag", cwd=repo_path).split():
+        git("checkout", "--quiet", "-f", tag, cwd=repo_path)
+        parse_files_with_tag(collect_tasks(str(repo_path)), tag, tag_time[tag], func_dict)
+    return func_dict
+
+
+def test_pipeline_matches_sequential(shared_remote, tmp_path):
+    try:
+        grammar.cached_library()
+    except FileNotFoundError:
+        pytest.skip("grammar library not built")
+    save_dir = tmp_path.joinpath("sigs")
+    cache_dir = tmp_path.joinpath("cache")
+    save_dir.mkdir()
+    for _ in range(3):
+        pipeline = ExtractionPipeline(str(save_dir), str(cache_dir),
+                                      git_jobs=1, parse_jobs=4, queue_size=8)
+        asyncio.run(pipeline.run([("tpl", shared_remote)]))
+        with open(save_dir.joinpath("tpl.json")) as fp:
+            signature = json.load(fp)
+        assert signature == sequential_signature(mirror_path(cache_dir, "tpl"))
+
+
+def test_failed_first_fetch_is_retried(shared_remote, tmp_path):
+    save_dir = tmp_path.joinpath("sigs")
+    cache_dir = tmp_path.joinpath("cache")
+    save_dir.mkdir()
+    missing = "file://%s" % tmp_path.joinpath("missing.git")
+    pipeline = ExtractionPipeline(str(save_dir), str(cache_dir), git_jobs=1, parse_jobs=1)
+    asyncio.run(pipeline.run([("tpl", missing)]))
+    assert not mirror_path(cache_dir, "tpl").exists()
+    assert not save_dir.joinpath("tpl.json").exists()
+
+    # the url is corrected in the csv
+    pipeline = ExtractionPipeline(str(save_dir), str(cache_dir), git_jobs=1, parse_jobs=1)
+    asyncio.run(pipeline.run([("tpl", shared_remote)]))
+    path = mirror_path(cache_dir, "tpl")
+    assert git("remote", "get-url", "origin", cwd=path).strip() == shared_remote
+    assert git("tag", cwd=path).split() == ["v1.0", "v1.1"]
+
+
+def fake_parse(file_cont, iscpp):
+    '''One function per file, `crash` kills the worker, `error` raises'''
+    if file_cont.startswith(b"crash"):
+        marker = os.environ.get("CRASH_ONCE_MARKER")
+        if marker is None or not os.path.exists(marker):
+            if marker is not None:
+                open(marker, "w").close()
+            os._exit(1)
+    if file_cont.startswith(b"error"):
+        raise ValueError("unparsable")
+    return [(hashlib.sha256(file_cont).hexdigest(), file_cont.decode())], 0.0, 0.0
+
+
+@pytest.fixture
+def crash_remote(tmp_path):
+    work_dir = tmp_path.joinpath("crash_work")
+    bare = tmp_path.joinpath("crash.git")
+    git("init", "--quiet", str(work_dir))
+    for name in ["a", "b", "crash", "error"]:
+        work_dir.joinpath(f"{name}.c").write_text(f"{name} {{}}\n")
+    git("add", ".", cwd=work_dir)
+    commit_and_tag(work_dir, "v1.0", "2020-01-01T00:00:00 +0000")
+    git("clone", "--quiet", "--bare", str(work_dir), str(bare))
+    return "file://%s" % bare
+
+
+def run_fake_parse(monkeypatch, tmp_path, url):
+    monkeypatch.setattr("pipeline.extract_functions_timed", fake_parse)
+    save_dir = tmp_path.joinpath("sigs")
+    save_dir.mkdir()
+    pipeline = ExtractionPipeline(str(save_dir), str(tmp_path.joinpath("cache")),
+                                  git_jobs=1, parse_jobs=2)
+    asyncio.run(pipeline.run([("tpl", url)]))
+    return save_dir.joinpath("tpl.json")
+
+
+def test_dead_worker_is_replaced(crash_remote, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRASH_ONCE_MARKER", str(tmp_path.joinpath("crashed")))
+    with open(run_fake_parse(monkeypatch, tmp_path, crash_remote)) as fp:
+        signature = json.load(fp)
+    assert tmp_path.joinpath("crashed").exists()
+    # the crashed file is parsed again, the parse error is only skipped
+    assert sorted(src for src, _ in signature.values()) == \
+        ["a {}\n", "b {}\n", "crash {}\n", "int v1_0(void) { return 0; }\n"]
+
+
+def test_lost_file_is_not_saved(crash_remote, tmp_path, monkeypatch):
+    monkeypatch.delenv("CRASH_ONCE_MARKER", raising=False)
+    # an incomplete signature would never be extracted again
+    assert not run_fake_parse(monkeypatch, tmp_path, crash_remote).exists()
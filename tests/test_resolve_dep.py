@@ -0,0 +1,74 @@
+import json
+
+import resolve_dep
+from scheduler import hash_part
+
+
+def load_corpus(corpus_dir):
+    tpl_sigs = dict()
+    for sig_path in corpus_dir.joinpath("func_sigs").glob("*.json"):
+        with open(sig_path) as fp:
+            tpl_sigs[sig_path.stem] = json.load(fp)
+    tpl2name = dict()
+    with open(corpus_dir.joinpath("tpls_name.csv")) as fp:
+        next(fp)
+        for line in fp:
+            tpl_id, tpl_name = line.strip().split(",")
+            tpl2name[tpl_id] = tpl_name
+    return tpl_sigs, tpl2name
+
+
+def test_reference_has_dependencies(reference):
+    assert reference.count(b"\n") > 1
+
+
+def test_split_signature_partitions_by_hash(corpus):
+    tpl_sigs, _ = load_corpus(corpus)
+    tpl_sig = max(tpl_sigs.values(), key=len)
+    tpl_parts = resolve_dep.split_signature(tpl_sig, 7)
+    assert sum(len(tpl_part) for tpl_part in tpl_parts) == len(tpl_sig)
+    for part, tpl_part in enumerate(tpl_parts):
+        assert all(hash_part(func_hash, 7) == part for func_hash in tpl_part)
+
+
+def test_split_parts_resolve_like_whole(corpus, monkeypatch):
+    tpl_sigs, tpl2name = load_corpus(corpus)
+    func_info_all = dict()
+    for tpl_id, tpl_sig in tpl_sigs.items():
+        for func_hash, func_infos in tpl_sig.items():
+            func_info_all.setdefault(func_hash, dict())[tpl_id] = \
+                resolve_dep.earliest_tag(func_infos[1])
+    monkeypatch.setattr(resolve_dep, "tpl_sigs", tpl_sigs, raising=False)
+    monkeypatch.setattr(resolve_dep, "tpl2name", tpl2name, raising=False)
+    func_origin = dict()
+    for func_hash, func_info in func_info_all.items():
+        origin = resolve_dep.resolve_func_origin(func_info)
+        if origin is not None:
+            func_origin[func_hash] = origin
+    monkeypatch.setattr(resolve_dep, "func_origin", func_origin, raising=False)
+
+    parts = 5
+    monkeypatch.setattr(resolve_dep, "tpl_splits", {
+        tpl_id: resolve_dep.split_signature(tpl_sig, parts)
+        for tpl_id, tpl_sig in tpl_sigs.items()
+    }, raising=False)
+    for tpl_id in tpl_sigs:
+        whole = resolve_dep.resolve_task([(tpl_id, 0, 1)])
+        split = resolve_dep.resolve_task([(tpl_id, part, parts) for part in range(parts)])
+        merged = dict()
+        for _, _, tpl_intersection in split[3]:
+            for tpl_id_x, reuse_set in tpl_intersection.items():
+                merged.setdefault(tpl_id_x, set()).update(reuse_set)
+        assert merged == dict(whole[3][0][2])
+        # each part handles only its own slice
+        assert split[2] == whole[2] == len(tpl_sigs[tpl_id])
+
+
+def test_out_of_core_matches_in_memory(corpus, reference, run_resolve_dep, tmp_path):
+    store_path = tmp_path.joinpath("ooc")
+    assert run_resolve_dep(corpus, store_path, "--mem_budget", "1") == reference
+    with open(store_path.joinpath("run_report.json")) as fp:
+        stages = [stage["name"] for stage in json.load(fp)["stages"]]
+    # the signatures are streamed, never loaded as a whole
+    assert "load_signatures" not in stages
+    assert not store_path.joinpath("tpl_sigs.pkl").exists()
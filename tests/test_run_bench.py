@@ -0,0 +1,43 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from run_bench import compare
+
+RUN_BENCH = Path(__file__).resolve().parents[1].joinpath("benchmarks", "run_bench.py")
+
+
+def run_bench(*args):
+    return subprocess.run(
+        [sys.executable, str(RUN_BENCH), "--scales", "small", "--repeat", "1",
+         "--c_files", "5"] + list(args),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ).returncode
+
+
+def test_run_bench_smoke(tmp_path):
+    output = tmp_path.joinpath("bench.json")
+    assert run_bench("--output", str(output)) == 0
+    with open(output) as fp:
+        results = json.load(fp)
+    resolve = results["benchmarks"]["resolve_small"]
+    assert resolve["wall"] > 0
+    assert resolve["functions_per_sec"] > 0
+    assert "resolve_pool.wall" in resolve
+    # the parser is benchmarked whenever the grammars are built
+    if "get_file_info_small" in results["benchmarks"]:
+        parser = results["benchmarks"]["get_file_info_small"]
+        assert parser["functions_per_sec"] > 0
+        assert parser["rss_peak_mb"] > 0
+
+    # identical metrics never regress, a faster baseline fails the run
+    assert compare(results, results, 0.2) == []
+    for metrics in results["benchmarks"].values():
+        for key in metrics:
+            metrics[key] = metrics[key] * (100 if key.endswith("_per_sec") else 0.01)
+    faster = tmp_path.joinpath("faster.json")
+    with open(faster, 'w') as fp:
+        json.dump(results, fp)
+    assert run_bench("--output", str(tmp_path.joinpath("slower.json")),
+                     "--compare", str(faster)) == 1
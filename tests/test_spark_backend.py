@@ -0,0 +1,26 @@
+import json
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("pyspark")
+if shutil.which("java") is None and "JAVA_HOME" not in os.environ:
+    pytest.skip("spark needs a java runtime", allow_module_level=True)
+
+
+def test_spark_backend_matches_local(corpus, reference, run_resolve_dep, tmp_path):
+    tpl_dep = run_resolve_dep(
+        corpus, tmp_path.joinpath("spark"),
+        "--backend", "spark", "--spark_master", "local[2]"
+    )
+    assert tpl_dep == reference
+
+
+def test_spark_report_has_filter_stages(corpus, run_resolve_dep, tmp_path):
+    store_path = tmp_path.joinpath("spark")
+    run_resolve_dep(corpus, store_path, "--backend", "spark", "--spark_master", "local[2]")
+    with open(store_path.joinpath("run_report.json")) as fp:
+        stages = {stage["name"]: stage["parent"] for stage in json.load(fp)["stages"]}
+    for name in ["bidirection", "cycle_removal", "centrality"]:
+        assert stages[name] == "spark"
@@ -0,0 +1,144 @@
+'''
+Columnar output of the dependency resolution.
+
+`tpl_edges.parquet` has one row per candidate edge (a tpl reusing functions
+whose origin is another tpl) with its metrics and filter decision.
+`tpl_edge_funcs.parquet` lists the shared functions of each edge by
+`hash_id`, resolved to the function hash through `func_hashes.parquet`.
+'''
+import config
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BATCH_SIZE = 1 << 20
+
+EDGE_SCHEMA = pa.schema([
+    ("edge_id", pa.int32()),
+    ("origin_tpl_uuid", pa.string()),
+    ("reuse_tpl_uuid", pa.string()),
+    ("reuse_num", pa.int64()),          # functions s reuses from x
+    ("func_num_s", pa.int64()),
+    ("func_num_x", pa.int64()),
+    ("reused_num_x", pa.int64()),       # functions x itself reuses
+    ("reuse_ratio", pa.float64()),
+    ("threshold", pa.float64()),
+    ("in_degree_s", pa.float64()),
+    ("in_degree_x", pa.float64()),
+    ("page_rank_x", pa.float64()),
+    ("cycle_break", pa.bool_()),
+    ("decision", pa.string()),
+])
+
+EDGE_FUNC_SCHEMA = pa.schema([
+    ("edge_id", pa.int32()),
+    ("hash_id", pa.int32()),
+])
+
+FUNC_HASH_SCHEMA = pa.schema([
+    ("hash_id", pa.int32()),
+    ("func_hash", pa.string()),
+])
+
+
+def edge_decision(edge, func_num, reused_num_x, ratio, threshold,
+                  recall_relation, evidence):
+    '''The first filter removing the edge, in the order the filters apply'''
+    tpl_id_x = edge[1]
+    if tpl_id_x not in func_num:
+        return "unknown_origin"
+    if func_num[tpl_id_x] - reused_num_x < 1:
+        return "no_exclusive_func"
+    if reused_num_x == 0:
+        return "origin_reuses_nothing"
+    if ratio < threshold:
+        return "below_threshold"
+    if edge in evidence["bidirection"]:
+        return "bidirection"
+    if edge in evidence["centrality"]:
+        return "centrality"
+    if edge not in recall_relation:
+        raise ValueError(f"edge {edge} passed every filter but was not recalled")
+    return "kept"
+
+
+def edge_rows(func_num, reuse_num, inter_num, recall_relation, evidence):
+    '''Yield the edge rows, ordered like their `edge_id`'''
+    in_degrees, page_ranks = evidence["in_degree"], evidence["page_rank"]
+    for edge_id, edge in enumerate(sorted(inter_num)):
+        tpl_id_s, tpl_id_x = edge
+        reuse_len = inter_num[edge]
+        func_num_x = func_num.get(tpl_id_x)
+        reused_num_x = reuse_num.get(tpl_id_x, 0)
+        ratio = reuse_len / func_num_x if func_num_x else None
+        threshold = None
+        if func_num_x and reused_num_x:
+            threshold = config.THRESHOLD * func_num_x / reused_num_x
+        yield {
+            "edge_id": edge_id,
+            "origin_tpl_uuid": tpl_id_s,
+            "reuse_tpl_uuid": tpl_id_x,
+            "reuse_num": reuse_len,
+            "func_num_s": func_num.get(tpl_id_s),
+            "func_num_x": func_num_x,
+            "reused_num_x": reused_num_x,
+            "reuse_ratio": ratio,
+            "threshold": threshold,
+            "in_degree_s": in_degrees.get(tpl_id_s),
+            "in_degree_x": in_degrees.get(tpl_id_x),
+            "page_rank_x": page_ranks.get(tpl_id_x),
+            "cycle_break": edge in evidence["cycle"],
+            "decision": edge_decision(
+                edge, func_num, reused_num_x, ratio, threshold,
+                recall_relation, evidence
+            ),
+        }
+
+
+def write_batches(writer, schema, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            batch = []
+    if len(batch):
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def write_edge_funcs(writer, inter_path, edge_ids, hash_ids):
+    '''Stream the intersection store into (edge_id, hash_id) columns'''
+    from results_store import iter_results
+
+    edge_col, hash_col = [], []
+    for tpl_id_s, tpl_intersection in iter_results(inter_path):
+        for tpl_id_x, reuse_set in tpl_intersection.items():
+            edge_id = edge_ids[(tpl_id_s, tpl_id_x)]
+            for func_hash in sorted(reuse_set):
+                edge_col.append(edge_id)
+                hash_col.append(hash_ids.setdefault(func_hash, len(hash_ids)))
+        if len(edge_col) >= BATCH_SIZE:
+            writer.write_table(pa.table([edge_col, hash_col], schema=EDGE_FUNC_SCHEMA))
+            edge_col, hash_col = [], []
+    if len(edge_col):
+        writer.write_table(pa.table([edge_col, hash_col], schema=EDGE_FUNC_SCHEMA))
+
+
+def write_dep_parquet(store_path, inter_path, func_num, reuse_num, inter_num,
+                      recall_relation, evidence):
+    '''Write the edge, shared function and hash tables under `store_path`'''
+    edge_ids = {edge: edge_id for edge_id, edge in enumerate(sorted(inter_num))}
+    with pq.ParquetWriter(store_path.joinpath("tpl_edges.parquet"), EDGE_SCHEMA) as writer:
+        write_batches(writer, EDGE_SCHEMA, edge_rows(
+            func_num, reuse_num, inter_num, recall_relation, evidence
+        ))
+
+    # hashes are interned in their first-seen order
+    hash_ids = dict()
+    with pq.ParquetWriter(store_path.joinpath("tpl_edge_funcs.parquet"), EDGE_FUNC_SCHEMA) as writer:
+        write_edge_funcs(writer, inter_path, edge_ids, hash_ids)
+
+    with pq.ParquetWriter(store_path.joinpath("func_hashes.parquet"), FUNC_HASH_SCHEMA) as writer:
+        hash_col = list(hash_ids)
+        writer.write_table(pa.table(
+            [list(range(len(hash_col))), hash_col], schema=FUNC_HASH_SCHEMA
+        ))
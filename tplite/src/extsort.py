@@ -0,0 +1,89 @@
+'''
+External sort of the function records for corpora larger than memory.
+
+A record is one `(func_hash, tpl, commit time, file path)` line. Records are
+buffered up to a memory budget, written to sorted runs on disk and merged
+back as a single stream ordered by function hash, then by tpl order.
+'''
+import heapq
+import json
+from itertools import groupby
+from pathlib import Path
+
+MAX_FANIN = 64          # runs merged at once
+RECORD_OVERHEAD = 64    # approximate bytes of a buffered str beyond its text
+
+
+def encode_record(func_hash, tpl_seq, tpl_id, commit_time, func_path):
+    # the zero-padded tpl_seq keeps the tpl order of a hash under a plain sort
+    return f"{func_hash}\t{tpl_seq:08d}\t{tpl_id}\t{commit_time}\t{json.dumps(func_path)}\n"
+
+
+def decode_record(line):
+    func_hash, _, tpl_id, commit_time, func_path = line.rstrip('\n').split('\t', 4)
+    return func_hash, tpl_id, commit_time, json.loads(func_path)
+
+
+def record_key(line):
+    return line[:line.index('\t')]
+
+
+def flush_run(buffer, run_dir, run_paths):
+    buffer.sort()
+    run_path = Path(run_dir).joinpath(f"run_{len(run_paths):06d}.txt")
+    with open(run_path, 'w') as fp:
+        fp.writelines(buffer)
+    run_paths.append(run_path)
+    buffer.clear()
+
+
+def write_runs(lines, run_dir, mem_budget):
+    '''Split the encoded lines into sorted runs of at most `mem_budget` bytes'''
+    Path(run_dir).mkdir(parents=True, exist_ok=True)
+    run_paths, buffer, buffer_size = [], [], 0
+    for line in lines:
+        buffer.append(line)
+        buffer_size += len(line) + RECORD_OVERHEAD
+        if buffer_size >= mem_budget:
+            flush_run(buffer, run_dir, run_paths)
+            buffer_size = 0
+    if len(buffer):
+        flush_run(buffer, run_dir, run_paths)
+    return run_paths
+
+
+def iter_merged(run_paths):
+    files = [open(run_path, 'r') for run_path in run_paths]
+    try:
+        yield from heapq.merge(*files)
+    finally:
+        for fp in files:
+            fp.close()
+
+
+def merge_runs(run_paths):
+    '''
+    Yield the lines of all runs in sorted order, first merging groups of
+    `MAX_FANIN` runs into intermediate runs when there are too many to open.
+    '''
+    run_paths = list(run_paths)
+    level = 0
+    while len(run_paths) > MAX_FANIN:
+        merged_paths = []
+        for i in range(0, len(run_paths), MAX_FANIN):
+            group = run_paths[i: i + MAX_FANIN]
+            merged_path = group[0].with_name(f"merge_{level}_{i:06d}.txt")
+            with open(merged_path, 'w') as fp:
+                fp.writelines(iter_merged(group))
+            for run_path in group:
+                run_path.unlink()
+            merged_paths.append(merged_path)
+        run_paths = merged_paths
+        level += 1
+    yield from iter_merged(run_paths)
+
+
+def group_records(lines):
+    '''Group the sorted lines by function hash into decoded records'''
+    for func_hash, group in groupby(lines, key=record_key):
+        yield func_hash, [decode_record(line) for line in group]
@@ -0,0 +1,197 @@
+'''
+Stage-level instrumentation shared by the extractor and resolve_dep.
+
+`RunReport` records per-stage wall and cpu time, RSS high-water marks,
+item counters and per-worker throughput, and dumps them as a json run
+report. `start_profiler` optionally wraps a run with cProfile or a
+statistical stack sampler.
+'''
+import cProfile
+import json
+import os
+import resource
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def max_rss():
+    '''Peak RSS in bytes of this process so far, from getrusage'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def children_max_rss():
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunReport:
+    def __init__(self, name, sample_interval=0.2):
+        self.name = name
+        self.sample_interval = sample_interval
+        self.started = time.time()
+        self.stages = []
+        self.counters = Counter()
+        self.workers = defaultdict(lambda: {"tasks": 0, "items": 0, "busy": 0.0})
+        self.sections = defaultdict(dict)
+        self.timeline = []
+        self._active = []   # stages currently open, innermost last
+        self._rss_peak = 0
+        self._children_peak = 0
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def start(self):
+        '''Sample the RSS in the background for precise stage peaks'''
+        if psutil is not None and self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample_once()
+
+    def _sample_once(self):
+        try:
+            proc = psutil.Process()
+            rss = proc.memory_info().rss
+            children = sum(child.memory_info().rss
+                           for child in proc.children(recursive=True))
+        except psutil.Error:
+            return
+        self._rss_peak = max(self._rss_peak, rss)
+        self._children_peak = max(self._children_peak, children)
+        for stage in list(self._active):
+            stage["rss_peak"] = max(stage["rss_peak"], rss)
+            stage["children_rss_peak"] = max(
+                stage["children_rss_peak"], children)
+
+    @contextmanager
+    def stage(self, name):
+        '''Time a stage and record its RSS high-water mark'''
+        stage = {
+            "name": name,
+            "parent": self._active[-1]["name"] if len(self._active) else None,
+            "rss_peak": 0,
+            "children_rss_peak": 0,
+        }
+        wall, cpu = time.perf_counter(), time.process_time()
+        self._active.append(stage)
+        if self._sampler is not None:
+            self._sample_once()
+        try:
+            yield stage
+        finally:
+            if self._sampler is not None:
+                self._sample_once()
+            self._active.remove(stage)
+            stage["wall"] = round(time.perf_counter() - wall, 6)
+            stage["cpu"] = round(time.process_time() - cpu, 6)
+            if self._sampler is None:
+                # without psutil only the process high-water mark is known
+                stage["rss_peak"] = max_rss()
+                stage["children_rss_peak"] = children_max_rss()
+            self.stages.append(stage)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def record_worker(self, worker_id, items, busy, tasks=1):
+        worker = self.workers[str(worker_id)]
+        worker["tasks"] += tasks
+        worker["items"] += items
+        worker["busy"] += busy
+
+    def record(self, section, key, value):
+        '''Attach a named entry, e.g. the cost of one repository'''
+        self.sections[section][key] = value
+
+    def snapshot(self, values):
+        self.timeline.append(dict(values, time=round(time.time() - self.started, 3)))
+
+    def to_dict(self):
+        workers = dict()
+        for worker_id, worker in self.workers.items():
+            workers[worker_id] = dict(
+                worker,
+                busy=round(worker["busy"], 6),
+                throughput=worker["items"] / worker["busy"] if worker["busy"] else None
+            )
+        return {
+            "name": self.name,
+            "argv": sys.argv,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "cpu_count": os.cpu_count(),
+            "started": self.started,
+            "wall": round(time.time() - self.started, 6),
+            "rss_peak": max(self._rss_peak, max_rss()),
+            "children_rss_peak": max(self._children_peak, children_max_rss()),
+            "stages": self.stages,
+            "counters": dict(self.counters),
+            "workers": workers,
+            "timeline": self.timeline,
+            **self.sections,
+        }
+
+    def dump(self, path):
+        self._stop.set()
+        with open(path, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=1)
+
+
+class StackSampler:
+    '''Statistical profiler writing collapsed stacks of the main thread'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def _handler(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._handler)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self, path):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        # flamegraph.pl / speedscope collapsed format
+        with open(path, 'w') as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write(f"{stack} {count}\n")
+
+
+def start_profiler(mode, path):
+    '''Start a `cprofile` or `sample` profiler, return the stop callback'''
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def stop():
+            profiler.disable()
+            profiler.dump_stats(path)
+        return stop
+    if mode == "sample":
+        sampler = StackSampler()
+        sampler.start()
+        return lambda: sampler.stop(path)
+    return lambda: None
@@ -5,18 +5,27 @@ import logging
 import os
 import pickle
 import pandas as pd
+import shutil
 import time
 import config
 import networkx as nx
 
 from collections import defaultdict
+from extsort import encode_record, group_records, merge_runs, write_runs
 from multiprocessing import Pool
 from pathlib import Path, PurePath
+from profiling import RunReport, start_profiler
+from results_store import append_result, completed_tpls, iter_results, open_store
+from scheduler import hash_part, plan_tasks
 from tqdm import tqdm
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+report = RunReport("resolve_dep")
+
 
 def valid_path(path: str) -> Path:
     try:
@@ -37,7 +46,27 @@ def parameter_parser():
     parser.add_argument("--store_path", type=str, default="./output/",
                         help="save path to the results")
     parser.add_argument("--cpu", type=int, default=1)
-    return parser.parse_args()
+    parser.add_argument("--mem_budget", type=int, default=None,
+                        help="memory budget (MB) of the function table, build "
+                             "it out-of-core with an external sort if set")
+    parser.add_argument("--backend", choices=["local", "spark"], default="local",
+                        help="multiprocessing on this node or pyspark jobs")
+    parser.add_argument("--spark_master", type=str, default="local[*]",
+                        help="spark master url of the spark backend")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also write every candidate edge with its metrics, "
+                             "filter decision and shared functions as parquet")
+    parser.add_argument("--report", type=Path, default=None,
+                        help="path of the json run report "
+                             "(default: <store_path>/run_report.json)")
+    parser.add_argument("--profile", choices=["cprofile", "sample"], default=None,
+                        help="profile the run with cProfile or a stack sampler")
+    parser.add_argument("--profile_out", type=str, default=None,
+                        help="path of the profile (default: next to the report)")
+    args = parser.parse_args()
+    if args.parquet and args.backend == "spark":
+        parser.error("--parquet is only supported by the local backend")
+    return args
 
 
 def obtain_tpl_sigs():
@@ -50,13 +79,59 @@ def obtain_tpl_sigs():
         logger.info("[+] construct the tpl signatures")
         tpl_sigs = dict()
         for tpl_sig in tqdm(args.tpl_sigs.glob("*"), total=tpl_num):
-            tpl_sigs[tpl_sig.name] = json.load(tpl_sig.open())
+            tpl_sigs[tpl_sig.stem] = json.load(tpl_sig.open())
         # dump the tpl signatures
         with open(tpl_sigs_path, 'wb') as fp:
             pickle.dump(tpl_sigs, fp)
     return tpl_sigs
 
 
+def iter_signatures():
+    '''Yield (tpl_id, tpl_sig), one signature file at a time out-of-core'''
+    if tpl_sigs is not None:
+        yield from tpl_sigs.items()
+        return
+    for tpl_id in sig_paths:
+        yield tpl_id, load_signature(tpl_id)
+
+
+def load_signature(tpl_id):
+    if tpl_sigs is not None:
+        return tpl_sigs[tpl_id]
+    with open(sig_paths[tpl_id], 'r') as fp:
+        return json.load(fp)
+
+
+def obtain_func_num():
+    '''Number of functions of each tpl'''
+    if func_num_path.exists():
+        with open(func_num_path, 'rb') as fp:
+            func_num = pickle.load(fp)
+    else:
+        func_num = {tpl_id: len(tpl_sig) for tpl_id, tpl_sig in iter_signatures()}
+        with open(func_num_path, 'wb') as fp:
+            pickle.dump(func_num, fp)
+    return func_num
+
+
+def earliest_tag(func_tags):
+    '''(commit time, file path) of the first tag containing a function'''
+    func_tag_infos = []
+    for tag_name, func_tag_info in func_tags.items():
+        # (func tag time, func file path)
+        commit_time = time.strptime(
+            func_tag_info[0],
+            TIME_FORMAT
+        )
+        func_file_path = func_tag_info[1]
+        func_tag_infos.append((
+            commit_time,
+            func_file_path
+        ))
+    func_tag_infos.sort(key=lambda x: x[0])
+    return func_tag_infos[0]
+
+
 def obtain_func_info():
     '''Construct the function data'''
     if func_info_path.exists():
@@ -68,27 +143,109 @@ def obtain_func_info():
         func_info_all = defaultdict(dict)
         for tpl_id, tpl_sig in tqdm(tpl_sigs.items(), total=len(tpl_sigs)):
             for func_hash, func_infos in tpl_sig.items():
-                func_src_code = func_infos[0]
                 func_tags: dict = func_infos[1]
-                func_tag_infos = []
-                for tag_name, func_tag_info in func_tags.items():
-                    # (func tag time, func file path)
-                    commit_time = time.strptime(
-                        func_tag_info[0],
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    func_file_path = func_tag_info[1]
-                    func_tag_infos.append((
-                        commit_time,
-                        func_file_path
-                    ))
-                func_tag_infos.sort(key=lambda x: x[0])
-                func_info_all[func_hash][tpl_id] = func_tag_infos[0]
+                func_info_all[func_hash][tpl_id] = earliest_tag(func_tags)
         with open(func_info_path, 'wb') as fp:
             pickle.dump(func_info_all, fp)
     return func_info_all
 
 
+def func_records(func_num):
+    '''
+    Encoded (func_hash, tpl, first tag time, path) of every function,
+    counting the functions of each tpl into `func_num` on the way
+    '''
+    for tpl_seq, (tpl_id, tpl_sig) in enumerate(tqdm(iter_signatures(), total=tpl_num)):
+        func_num[tpl_id] = len(tpl_sig)
+        for func_hash, func_infos in tpl_sig.items():
+            commit_time, func_file_path = earliest_tag(func_infos[1])
+            yield encode_record(
+                func_hash, tpl_seq, tpl_id,
+                time.strftime(TIME_FORMAT, commit_time), func_file_path
+            )
+
+
+def obtain_func_runs():
+    '''Write the function data to sorted runs within the memory budget'''
+    logger.info("[+] construct the sorted runs of functions")
+    if func_runs_path.exists():
+        shutil.rmtree(func_runs_path)
+    func_num = dict()
+    run_paths = write_runs(
+        func_records(func_num),
+        func_runs_path,
+        args.mem_budget * 1024 * 1024
+    )
+    logger.info(f"[+] {len(run_paths)} sorted runs of functions")
+    # spares obtain_func_num another pass over the signatures
+    with open(func_num_path, 'wb') as fp:
+        pickle.dump(func_num, fp)
+    return run_paths
+
+
+def iter_func_groups(run_paths):
+    '''Stream (func_hash, func_info) out of the merged runs'''
+    for func_hash, records in group_records(merge_runs(run_paths)):
+        func_info = dict()
+        for _, tpl_id, commit_time, func_file_path in records:
+            func_info[tpl_id] = (
+                time.strptime(commit_time, TIME_FORMAT),
+                func_file_path
+            )
+        yield func_hash, func_info
+
+
+def resolve_func_origin(func_info):
+    '''Origin (tpl_id, commit time or 0) of a function, None if unique'''
+    if len(func_info) <= 1:
+        return None
+    origin = None
+    tpl_time = list()
+    seg_count = defaultdict(int)
+    tpl_name_id = defaultdict(list)
+    for tpl_id, info in func_info.items():
+        extern_flag = False
+        seg_set = set()
+        tpl_name = tpl2name[tpl_id]
+        func_path = PurePath(info[1].lower())
+        commit_time = info[0]
+        for seg in func_path.parent.parts + (func_path.stem,):
+            if seg in config.EXTERN_FLAG:
+                extern_flag = True
+            if seg in config.BLACK_SET or seg == tpl_name:
+                continue
+            seg_set.add(seg)
+        for seg in seg_set:
+            seg_count[seg] += 1
+        if not extern_flag:
+            tpl_info = (tpl_id, commit_time)
+            tpl_name_id[tpl_name].append(tpl_info)
+            tpl_time.append(tpl_info)
+    # check the function path
+    if len(seg_count):
+        tpl_candidate = list()
+        lower_count = 1 if len(func_info) <= 3 else 2
+        seg_sort = sorted(seg_count.items(),
+                          reverse=True, key=lambda x: x[1])
+        for seg, count in seg_sort:
+            if count < lower_count:
+                break
+            if seg in config.SPECIAL_CASE:
+                origin = (config.SPECIAL_CASE[seg], 0)
+                break
+            if seg in tpl_name_id:
+                tpl_candidate.extend(tpl_name_id[seg])
+        if origin is None and len(tpl_candidate):
+            tpl_candidate.sort(key=lambda x: x[1])
+            origin = (tpl_candidate[0][0], 0)
+
+    if origin is None and len(tpl_time):
+        # check function birth time
+        tpl_time.sort(key=lambda x: x[1])
+        origin = tpl_time[0]
+    return origin
+
+
 def obtain_func_origin():
     '''Construct the origin tpl of functions'''
     if func_origin_path.exists():
@@ -97,86 +254,258 @@ def obtain_func_origin():
             func_origin = pickle.load(fp)
     else:
         logger.info("[+] construct the origin tpl of functions")
+        if func_info_all is None:
+            # out-of-core mode, functions arrive grouped by hash
+            func_groups = tqdm(iter_func_groups(obtain_func_runs()))
+        else:
+            func_groups = tqdm(func_info_all.items(), total=len(func_info_all))
         # parse the origin tpl
         func_origin = dict()
-        for func_id, func_info in tqdm(func_info_all.items(), total=len(func_info_all)):
-            if len(func_info) <= 1:
-                continue
-            tpl_time = list()
-            seg_count = defaultdict(int)
-            tpl_name_id = defaultdict(list)
-            for tpl_id, info in func_info.items():
-                extern_flag = False
-                seg_set = set()
-                tpl_name = tpl2name[tpl_id]
-                func_path = PurePath(info[1].lower())
-                commit_time = info[0]
-                for seg in func_path.parent.parts + (func_path.stem,):
-                    if seg in config.EXTERN_FLAG:
-                        extern_flag = True
-                    if seg in config.BLACK_SET or seg == tpl_name:
-                        continue
-                    seg_set.add(seg)
-                for seg in seg_set:
-                    seg_count[seg] += 1
-                if not extern_flag:
-                    tpl_info = (tpl_id, commit_time)
-                    tpl_name_id[tpl_name].append(tpl_info)
-                    tpl_time.append(tpl_info)
-            # check the function path
-            if len(seg_count):
-                tpl_candidate = list()
-                lower_count = 1 if len(func_info) <= 3 else 2
-                seg_sort = sorted(seg_count.items(),
-                                  reverse=True, key=lambda x: x[1])
-                for seg, count in seg_sort:
-                    if count < lower_count:
-                        break
-                    if seg in config.SPECIAL_CASE:
-                        func_origin[func_id] = (config.SPECIAL_CASE[seg], 0)
-                        break
-                    if seg in tpl_name_id:
-                        tpl_candidate.extend(tpl_name_id[seg])
-                if func_id not in func_origin and len(tpl_candidate):
-                    tpl_candidate.sort(key=lambda x: x[1])
-                    func_origin[func_id] = (tpl_candidate[0][0], 0)
-
-            if func_id not in func_origin and len(tpl_time):
-                # check function birth time
-                tpl_time.sort(key=lambda x: x[1])
-                func_origin[func_id] = tpl_time[0]
+        for func_id, func_info in func_groups:
+            origin = resolve_func_origin(func_info)
+            if origin is not None:
+                func_origin[func_id] = origin
 
         with open(func_origin_path, 'wb') as fp:
             pickle.dump(func_origin, fp)
+        if func_info_all is None:
+            shutil.rmtree(func_runs_path)
 
     return func_origin
 
 
-def resolve_source_relation(tpl_id):
-    '''Identify reused functions'''
-    res = dict()
+def split_signature(tpl_sig, parts):
+    '''Partition the functions of a tpl into its `parts` hash ranges'''
+    tpl_parts = [dict() for _ in range(parts)]
+    for func_hash, func_infos in tpl_sig.items():
+        tpl_parts[hash_part(func_hash, parts)][func_hash] = func_infos
+    return tpl_parts
+
+
+def tpl_part_path(tpl_id, part):
+    return tpl_parts_path.joinpath(f"{tpl_id}.{part}.json")
+
+
+def obtain_tpl_splits(tasks):
+    '''
+    Split the tpls planned in several parts, once for all their parts.
+    Out-of-core, the parts are written to disk and None is returned.
+    '''
+    split_parts = dict()
+    for task in tasks:
+        for tpl_id, _, parts in task:
+            if parts > 1:
+                split_parts[tpl_id] = parts
+    if tpl_sigs is not None:
+        return {tpl_id: split_signature(tpl_sigs[tpl_id], parts)
+                for tpl_id, parts in split_parts.items()}
+    if tpl_parts_path.exists():
+        shutil.rmtree(tpl_parts_path)
+    tpl_parts_path.mkdir(parents=True)
+    for tpl_id, parts in split_parts.items():
+        for part, tpl_part in enumerate(split_signature(load_signature(tpl_id), parts)):
+            with open(tpl_part_path(tpl_id, part), 'w') as fp:
+                # only the tags are needed by the intersection
+                json.dump({func_hash: ["", func_infos[1]]
+                           for func_hash, func_infos in tpl_part.items()}, fp)
+    return None
+
+
+def tpl_slice(tpl_id, part=0, parts=1):
+    '''Functions of a tpl within the hash range `part` of `parts`'''
+    if parts == 1:
+        return load_signature(tpl_id)
+    # split once by the parent, not once per part
+    if tpl_splits is not None:
+        return tpl_splits[tpl_id][part]
+    with open(tpl_part_path(tpl_id, part), 'r') as fp:
+        return json.load(fp)
+
+
+def intersect_functions(tpl_id, tpl_sig_s):
+    '''Group the functions tpl_id reuses by their origin tpl'''
     tpl_intersection = defaultdict(set)
-    tpl_sig_s = tpl_sigs[tpl_id]
     for func_hash, func_info in tpl_sig_s.items():
-        origin_time = func_info[1]
         if func_hash not in func_origin.keys():
             continue
         tpl_id_x, origin_time_x = func_origin[func_hash]
         if tpl_id_x == tpl_id:
             continue
+        origin_time = earliest_tag(func_info[1])[0]
         if origin_time_x == 0 or origin_time_x < origin_time:
             tpl_intersection[tpl_id_x].add(func_hash)
-    res[tpl_id] = tpl_intersection
-    return res
+    return tpl_intersection
+
+
+def resolve_source_relation(tpl_id, part=0, parts=1):
+    '''Identify reused functions, within the hash range `part` of `parts`'''
+    return {tpl_id: intersect_functions(tpl_id, tpl_slice(tpl_id, part, parts))}
+
+
+def resolve_task(task):
+    '''
+    Resolve a batch of (tpl_id, part, parts) planned by the scheduler,
+    along with the worker pid, busy seconds and number of functions
+    '''
+    start_time = time.perf_counter()
+    res = list()
+    items = 0
+    for tpl_id, part, parts in task:
+        tpl_sig_s = tpl_slice(tpl_id, part, parts)
+        res.append((tpl_id, parts, intersect_functions(tpl_id, tpl_sig_s)))
+        items += len(tpl_sig_s)
+    return os.getpid(), time.perf_counter() - start_time, items, res
+
+
+def summarize_results(inter_path):
+    '''Stream the results store into the counts used by the recall'''
+    reuse_num = dict()  # tpl -> number of functions it reuses
+    inter_num = dict()  # (tpl_id_s, tpl_id_x) -> functions s reuses from x
+    for tpl_id_s, tpl_intersection in iter_results(inter_path):
+        tpl_reuse_set = set()
+        for tpl_id_x, reuse_set in tpl_intersection.items():
+            inter_num[(tpl_id_s, tpl_id_x)] = len(reuse_set)
+            tpl_reuse_set |= reuse_set
+        reuse_num[tpl_id_s] = len(tpl_reuse_set)
+    return reuse_num, inter_num
+
+
+def reuse_candidates(func_num, reuse_num, inter_num):
+    '''Reuse relations whose reuse ratio passes the threshold'''
+    recall_relation = set()
+    for (tpl_id_s, tpl_id_x), reuse_len in inter_num.items():
+        if tpl_id_x not in func_num:
+            # origin outside the corpus, e.g. a special case
+            continue
+        # exclude the reused count
+        func_num_x = func_num[tpl_id_x]
+        reused_num_x = reuse_num.get(tpl_id_x, 0)
+        tpl_len_x = func_num_x - reused_num_x
+        if tpl_len_x < 1 or reused_num_x == 0:
+            continue
+        if reuse_len / func_num_x >= config.THRESHOLD * func_num_x / reused_num_x:
+            recall_relation.add((tpl_id_s, tpl_id_x))
+    return recall_relation
+
+
+def filter_relations(recall_relation, func_num, inter_num, evidence=None,
+                     report=report):
+    '''
+    Remove the false reuse relations by direction and centrality.
+    If `evidence` is a dict, it receives the removed edges of each filter
+    and the centrality scores. The filter stages are timed in `report`.
+    '''
+    # handle the bidirection false
+    remove_set = set()
+    with report.stage("bidirection"):
+        for tpl_id_s, tpl_id_x in recall_relation:
+            if (tpl_id_x, tpl_id_s) not in recall_relation:
+                continue
+            reuse_len_s = inter_num[(tpl_id_s, tpl_id_x)]
+            reuse_len_x = inter_num[(tpl_id_x, tpl_id_s)]
+            if reuse_len_s <= reuse_len_x:
+                remove_set.add((tpl_id_s, tpl_id_x))
+            else:
+                remove_set.add((tpl_id_x, tpl_id_s))
+    recall_relation = recall_relation - remove_set
+    bidirection_set = remove_set
+
+    # eliminate the cycle
+    def splite_cycle(input_list):
+        res = list()
+        start_id = input_list[0]
+        for i in range(1, len(input_list)):
+            res.append((start_id, input_list[i]))
+            start_id = input_list[i]
+        res.append((start_id, input_list[0]))
+        return res
+
+    timeout = 300
+    start_time = time.time()
+    remove_set = set()
+    graph = nx.DiGraph(list(recall_relation))
+    with report.stage("cycle_removal"):
+        while time.time() - start_time < timeout:
+            cycles = nx.simple_cycles(graph)
+            cycle_count = len(list(cycles))
+            if cycle_count == 0:
+                break
+            cycle_edge_count = defaultdict(int)
+            for cycle in nx.simple_cycles(graph):
+                for edge in splite_cycle(cycle):
+                    cycle_edge_count[edge] += 1
+            edge_count_sort = sorted(
+                cycle_edge_count.items(),
+                key=lambda x: x[1],
+                reverse=True
+            )
+            for edge, _ in edge_count_sort:
+                graph.remove_edge(*edge)
+                remove_set.add(edge)
+                logger.info(
+                    f"[+] Total cycles: {cycle_count}, remove edge: {edge}")
+                break
+    cycle_set = remove_set
+
+    with report.stage("centrality"):
+        # pagerank & in-degree, a fixed edge order keeps the scores reproducible
+        dep_graph = nx.DiGraph()
+        for tpl_id_s, tpl_id_x in sorted(recall_relation):
+            reuse_len = inter_num[(tpl_id_s, tpl_id_x)]
+            dep_graph.add_edge(tpl_id_s, tpl_id_x,
+                               weight=reuse_len / func_num[tpl_id_x])
+
+        logger.info(f"[+] dependency graph has {len(dep_graph.nodes)} nodes and "
+                    f"{len(dep_graph.edges)} edges")
+
+        def in_degree_centrality(graph):
+            s = 1.0 / (len(graph) - 1)
+            centrality = {n: d * s for n, d in graph.in_degree(weight='weight')}
+            return centrality
+
+        in_degrees = in_degree_centrality(dep_graph)
+        page_ranks = nx.pagerank(dep_graph, alpha=0.85, weight='weight')
+
+        remove_set = set()
+        for tpl_id_s, tpl_id_x in recall_relation:
+            if (
+                in_degrees[tpl_id_s] > config.IN_DEGREE_THRE and
+                page_ranks[tpl_id_x] /
+                    in_degrees[tpl_id_x] > config.CENTRALITY_THRE
+            ):
+                remove_set.add((tpl_id_s, tpl_id_x))
+
+    if evidence is not None:
+        evidence["bidirection"] = bidirection_set
+        # the cycle edges are reported only, they stay in the relation
+        evidence["cycle"] = cycle_set
+        evidence["centrality"] = remove_set
+        evidence["in_degree"] = in_degrees
+        evidence["page_rank"] = page_ranks
+    return recall_relation - remove_set
+
+
+def recall_dependencies(func_num, reuse_num, inter_num, evidence=None):
+    '''Filter the reuse candidates into the tpl dependencies'''
+    recall_relation = reuse_candidates(func_num, reuse_num, inter_num)
+    return filter_relations(recall_relation, func_num, inter_num, evidence)
+
+
+def write_dependencies(save_path, recall_relation):
+    with open(save_path, "w") as fp:
+        fp.write("origin_tpl_uuid,reuse_tpl_uuid\n")
+        for tpl_id_s, tpl_id_x in sorted(recall_relation):
+            fp.write(f"{tpl_id_s},{tpl_id_x}\n")
 
 
 def main():
     global tpl_num, tpl2name
-    global tpl_sigs, tpl_sigs_path
-    global func_info_all, func_info_path
+    global tpl_sigs, tpl_sigs_path, sig_paths
+    global func_info_all, func_info_path, func_runs_path, func_num_path
     global func_origin, func_origin_path
+    global tpl_splits, tpl_parts_path
 
-    tpl_list = os.listdir(args.tpl_sigs)
+    tpl_list = [PurePath(name).stem for name in os.listdir(args.tpl_sigs)]
     tpl_num = len(tpl_list)
     store_path = Path(args.store_path)
     if not store_path.exists():
@@ -184,138 +513,114 @@ def main():
 
     # load the tpl name
     tpl2name = dict()
-    df = pd.read_csv(args.tpl_name, sep=',', header=0)
+    df = pd.read_csv(args.tpl_name, sep=',', header=0, keep_default_na=False)
     for data in df.itertuples():
         tpl2name[data[1]] = data[2].lower()
 
+    if args.backend == "spark":
+        from spark_backend import resolve_with_spark
+        with report.stage("spark"):
+            recall_relation = resolve_with_spark(
+                list(args.tpl_sigs.glob("*")), tpl2name, args.spark_master, report
+            )
+        write_dependencies(store_path.joinpath("tpl_dep.csv"), recall_relation)
+        logger.info("[*] finish the recall relation")
+        return
+
+    # in the order of obtain_tpl_sigs, which breaks the origin ties
+    sig_paths = {sig_path.stem: sig_path for sig_path in args.tpl_sigs.glob("*")}
     tpl_sigs_path = store_path.joinpath("tpl_sigs.pkl")
-    tpl_sigs = obtain_tpl_sigs()
-
     func_info_path = store_path.joinpath("func_info_all.pkl")
-    func_info_all = obtain_func_info()
+    func_runs_path = store_path.joinpath("func_runs")
+    func_num_path = store_path.joinpath("func_num.pkl")
+    tpl_parts_path = store_path.joinpath("tpl_parts")
+    if args.mem_budget is None:
+        with report.stage("load_signatures"):
+            tpl_sigs = obtain_tpl_sigs()
+        with report.stage("func_info"):
+            func_info_all = obtain_func_info()
+        report.count("unique_functions", len(func_info_all))
+    else:
+        # out-of-core, the signatures are streamed from their files
+        tpl_sigs = None
+        func_info_all = None
 
     func_origin_path = store_path.joinpath("func_origin.pkl")
-    func_origin = obtain_func_origin()
+    with report.stage("func_origin"):
+        func_origin = obtain_func_origin()
+    report.count("shared_functions", len(func_origin))
+    func_num = obtain_func_num()
+    report.count("tpls", len(func_num))
+    report.count("functions", sum(func_num.values()))
 
     logger.info("[+] resolve the source relation")
+    inter_path = store_path.joinpath("tpl_inter.jsonl")
+    tpl_done = completed_tpls(inter_path)
+    tpl_todo = [tpl_id for tpl_id in tpl_list if tpl_id not in tpl_done]
+    if len(tpl_done):
+        logger.info(f"[+] resume with {len(tpl_done)} checkpointed tpls")
+    tasks = plan_tasks({tpl_id: func_num[tpl_id] for tpl_id in tpl_todo}, args.cpu)
+    logger.info(f"[+] schedule {len(tpl_todo)} tpls as {len(tasks)} tasks")
+    # the workers inherit the parts of the split tpls
+    tpl_splits = obtain_tpl_splits(tasks)
+    # partial intersections of the tpls split into hash ranges
+    tpl_parts = defaultdict(lambda: [0, defaultdict(set)])
     pool = Pool(args.cpu)
-    tpl_intersection_all = dict()
-    with tqdm(total=tpl_num) as pbar:
-        for res in pool.imap_unordered(resolve_source_relation, tpl_list):
-            tpl_intersection_all.update(res)
-            pbar.update()
+    with report.stage("resolve_pool"), open_store(inter_path) as store, \
+            tqdm(total=tpl_num, initial=len(tpl_done)) as pbar:
+        for pid, busy, items, res in pool.imap_unordered(resolve_task, tasks, chunksize=1):
+            report.record_worker(pid, items, busy)
+            for tpl_id, parts, tpl_intersection in res:
+                if parts > 1:
+                    merged = tpl_parts[tpl_id]
+                    merged[0] += 1
+                    for tpl_id_x, reuse_set in tpl_intersection.items():
+                        merged[1][tpl_id_x] |= reuse_set
+                    if merged[0] < parts:
+                        continue
+                    tpl_intersection = tpl_parts.pop(tpl_id)[1]
+                append_result(store, tpl_id, tpl_intersection)
+                pbar.update()
     pool.close()
     pool.join()
-
-    logger.info("[+] dump the intersection results")
-    with open(store_path.joinpath("tpl_inter.pkl"), 'wb') as fp:
-        pickle.dump(tpl_intersection_all, fp)
-
-    # count all reused functions for each tpl
-    tpl_reuse_set = defaultdict(set)
-    for tpl_id_s, tpl_intersection in tpl_intersection_all.items():
-        for reuse_list in tpl_intersection.values():
-            tpl_reuse_set[tpl_id_s] |= set(reuse_list)
-
-    recall_relation = set()
-    tpl_reuse = defaultdict(list)
-    for tpl_id_s, tpl_intersection in tpl_intersection_all.items():
-        for tpl_id_x, reuse_list in tpl_intersection.items():
-            # exclude the reused count
-            func_num_x = len(tpl_sigs[tpl_id_x])
-            reused_num_x = len(tpl_reuse_set[tpl_id_x])
-            tpl_len_x = len(tpl_sigs[tpl_id_x]) - len(tpl_reuse_set[tpl_id_x])
-            if tpl_len_x < 1:
-                continue
-            if len(reuse_list) / func_num_x >= config.THRESHOLD * func_num_x / reused_num_x:
-                recall_relation.add((tpl_id_s, tpl_id_x))
-                tpl_reuse[tpl_id_s].append(tpl_id_x)
-
-    # handle the bidirection false
-    remove_set = set()
-    for tpl_id_s, tpl_id_x in recall_relation:
-        if (tpl_id_x, tpl_id_s) not in recall_relation:
-            continue
-        reuse_list_s = tpl_intersection_all[tpl_id_s][tpl_id_x]
-        reuse_list_x = tpl_intersection_all[tpl_id_x][tpl_id_s]
-        if len(reuse_list_s) <= len(reuse_list_x):
-            remove_set.add((tpl_id_s, tpl_id_x))
-        else:
-            remove_set.add((tpl_id_x, tpl_id_s))
-    recall_relation = recall_relation - remove_set
-
-    # eliminate the cycle
-    def splite_cycle(input_list):
-        res = list()
-        start_id = input_list[0]
-        for i in range(1, len(input_list)):
-            res.append((start_id, input_list[i]))
-            start_id = input_list[i]
-        res.append((start_id, input_list[0]))
-        return res
-
-    timeout = 300
-    start_time = time.time()
-    remove_set = set()
-    graph = nx.DiGraph(list(recall_relation))
-    while time.time() - start_time < timeout:
-        cycles = nx.simple_cycles(graph)
-        cycle_count = len(list(cycles))
-        if cycle_count == 0:
-            break
-        cycle_edge_count = defaultdict(int)
-        for cycle in nx.simple_cycles(graph):
-            for edge in splite_cycle(cycle):
-                cycle_edge_count[edge] += 1
-        edge_count_sort = sorted(
-            cycle_edge_count.items(),
-            key=lambda x: x[1],
-            reverse=True
+    report.count("tasks", len(tasks))
+    if tpl_parts_path.exists():
+        shutil.rmtree(tpl_parts_path)
+
+    logger.info("[+] aggregate the intersection results")
+    with report.stage("aggregate"):
+        reuse_num, inter_num = summarize_results(inter_path)
+    report.count("candidate_edges", len(inter_num))
+    evidence = dict() if args.parquet else None
+    with report.stage("recall"):
+        recall_relation = recall_dependencies(
+            func_num, reuse_num, inter_num, evidence
         )
-        for edge, _ in edge_count_sort:
-            graph.remove_edge(*edge)
-            remove_set.add(edge)
-            logger.info(
-                f"[+] Total cycles: {cycle_count}, remove edge: {edge}")
-            break
-
-    # pagerank & in-degree
-    dep_graph = nx.DiGraph()
-    for tpl_id_s, tpl_id_x in recall_relation:
-        reuse_num = len(tpl_intersection_all[tpl_id_s][tpl_id_x])
-        func_num_x = len(tpl_sigs[tpl_id_x])
-        dep_graph.add_edge(tpl_id_s, tpl_id_x, weight=reuse_num / func_num_x)
-
-    logger.info(f"[+] dependency graph has {len(dep_graph.nodes)} nodes and "
-                f"{len(dep_graph.edges)} edges")
-
-    def in_degree_centrality(graph):
-        s = 1.0 / (len(graph) - 1)
-        centrality = {n: d * s for n, d in graph.in_degree(weight='weight')}
-        return centrality
-
-    in_degrees = in_degree_centrality(dep_graph)
-    page_ranks = nx.pagerank(dep_graph, alpha=0.85, weight='weight')
-
-    remove_set = set()
-    for tpl_id_s, tpl_id_x in recall_relation:
-        if (
-            in_degrees[tpl_id_s] > config.IN_DEGREE_THRE and
-            page_ranks[tpl_id_x] /
-                in_degrees[tpl_id_x] > config.CENTRALITY_THRE
-        ):
-            remove_set.add((tpl_id_s, tpl_id_x))
-    recall_relation = recall_relation - remove_set
-
-    save_path = store_path.joinpath("tpl_dep.csv")
-    with open(save_path, "w") as fp:
-        fp.write("origin_tpl_uuid,reuse_tpl_uuid\n")
-        for tpl_id_s, tpl_id_x in recall_relation:
-            fp.write(f"{tpl_id_s},{tpl_id_x}\n")
+    report.count("dependencies", len(recall_relation))
+
+    write_dependencies(store_path.joinpath("tpl_dep.csv"), recall_relation)
+    if args.parquet:
+        from dep_output import write_dep_parquet
+        logger.info("[+] dump the dependency evidence")
+        with report.stage("parquet"):
+            write_dep_parquet(
+                store_path, inter_path, func_num, reuse_num, inter_num,
+                recall_relation, evidence
+            )
 
     logger.info("[*] finish the recall relation")
 
 
 if __name__ == '__main__':
     args = parameter_parser()
-    main()
+    report_path = args.report or Path(args.store_path).joinpath("run_report.json")
+    report.start()
+    stop_profiler = start_profiler(
+        args.profile, args.profile_out or f"{report_path}.{args.profile}"
+    )
+    try:
+        main()
+    finally:
+        stop_profiler()
+        if report_path.parent.exists():
+            report.dump(report_path)
@@ -0,0 +1,74 @@
+'''
+Append-only store of the per-tpl intersection results.
+
+Each line holds one completed tpl as `tpl_id<TAB>{"tpl_id_x": [func_hash]}`.
+A tpl is checkpointed once its line is on disk, a restarted run skips the
+tpls already in the store and the aggregation reads it line by line.
+'''
+import json
+import os
+from contextlib import contextmanager
+
+
+def repair_store(store_path):
+    '''Drop a partial trailing line left by an interrupted write'''
+    if not os.path.exists(store_path):
+        return
+    with open(store_path, 'rb+') as fp:
+        end = fp.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(pos, 1 << 16)
+            fp.seek(pos - step)
+            chunk = fp.read(step)
+            idx = chunk.rfind(b'\n')
+            if idx != -1:
+                pos = pos - step + idx + 1
+                break
+            pos -= step
+        if pos != end:
+            fp.truncate(pos)
+
+
+def completed_tpls(store_path):
+    '''Ids of the tpls already checkpointed in the store'''
+    repair_store(store_path)
+    done = set()
+    if not os.path.exists(store_path):
+        return done
+    with open(store_path, 'r') as fp:
+        for line in fp:
+            done.add(line.split('\t', 1)[0])
+    return done
+
+
+@contextmanager
+def open_store(store_path):
+    repair_store(store_path)
+    with open(store_path, 'a') as fp:
+        yield fp
+
+
+def append_result(fp, tpl_id, tpl_intersection):
+    '''Persist the intersection of one tpl, it is durable on return'''
+    record = {tpl_id_x: sorted(reuse_set)
+              for tpl_id_x, reuse_set in tpl_intersection.items()}
+    fp.write(f"{tpl_id}\t{json.dumps(record, separators=(',', ':'))}\n")
+    fp.flush()
+    os.fsync(fp.fileno())
+
+
+def iter_results(store_path):
+    '''Yield (tpl_id, {tpl_id_x: set of reused func hashes})'''
+    with open(store_path, 'r') as fp:
+        for line in fp:
+            if not line.endswith('\n'):
+                break
+            tpl_id, record = line.split('\t', 1)
+            yield tpl_id, {tpl_id_x: set(reuse_list)
+                           for tpl_id_x, reuse_list in json.loads(record).items()}
+
+
+def load_results(store_path):
+    '''Materialize the whole store, the former `tpl_inter.pkl` content'''
+    return dict(iter_results(store_path))
@@ -0,0 +1,56 @@
+'''
+Cost-aware scheduling of the source relation tasks.
+
+The cost of a tpl is the number of functions in its signature. Tasks are
+dispatched largest-first so that no giant tpl starts last. Tpls far above
+the target task cost are split into hash-range parts whose partial
+intersections are merged afterwards, and small tpls are batched together
+to amortize the per-task IPC.
+'''
+import math
+
+HASH_PREFIX = 8                 # hex digits of the func hash used for ranges
+HASH_SPACE = 16 ** HASH_PREFIX
+TASKS_PER_CPU = 8
+MIN_TASK_COST = 1000
+MAX_PARTS = 256
+
+
+def hash_part(func_hash, parts):
+    '''Index of the contiguous hash range containing `func_hash`'''
+    return int(func_hash[:HASH_PREFIX], 16) * parts // HASH_SPACE
+
+
+def task_cost(task, tpl_costs):
+    return sum(tpl_costs[tpl_id] / parts for tpl_id, _, parts in task)
+
+
+def plan_tasks(tpl_costs, cpu, target_cost=None):
+    '''
+    Group `{tpl_id: cost}` into tasks, largest first.
+    A task is a list of `(tpl_id, part, parts)`: the functions of `tpl_id`
+    whose hash falls in range `part` out of `parts` equal ranges.
+    '''
+    if target_cost is None:
+        total_cost = sum(tpl_costs.values())
+        target_cost = max(
+            math.ceil(total_cost / (max(cpu, 1) * TASKS_PER_CPU)),
+            MIN_TASK_COST
+        )
+    tasks, batch, batch_cost = [], [], 0
+    for tpl_id, cost in sorted(tpl_costs.items(), key=lambda x: x[1], reverse=True):
+        if cost > 2 * target_cost:
+            parts = min(math.ceil(cost / target_cost), MAX_PARTS)
+            tasks.extend([(tpl_id, part, parts)] for part in range(parts))
+        elif cost >= target_cost:
+            tasks.append([(tpl_id, 0, 1)])
+        else:
+            batch.append((tpl_id, 0, 1))
+            batch_cost += cost
+            if batch_cost >= target_cost:
+                tasks.append(batch)
+                batch, batch_cost = [], 0
+    if len(batch):
+        tasks.append(batch)
+    tasks.sort(key=lambda task: task_cost(task, tpl_costs), reverse=True)
+    return tasks
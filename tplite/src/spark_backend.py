@@ -0,0 +1,187 @@
+'''
+PySpark backend of the dependency resolution.
+
+The func-info, origin detection, intersection and reuse ratio stages run as
+DataFrame jobs, so the same code runs in `local[*]` mode and on a cluster.
+Only the recalled edges are collected to the driver, where the direction and
+centrality filters of `resolve_dep` produce the same `tpl_dep.csv` as the
+multiprocessing backend.
+'''
+import json
+import logging
+import time
+from pathlib import Path
+
+import config
+import resolve_dep
+from pyspark.sql import SparkSession, Window
+from pyspark.sql import functions as F
+from pyspark.sql import types as T
+
+logger = logging.getLogger(__name__)
+
+TAG_SCHEMA = T.StructType([
+    T.StructField("tpl_id", T.StringType()),
+    T.StructField("tpl_seq", T.IntegerType()),
+    T.StructField("func_hash", T.StringType()),
+    T.StructField("tag_pos", T.IntegerType()),
+    T.StructField("commit_time", T.StringType()),
+    T.StructField("func_path", T.StringType()),
+])
+
+ORIGIN_SCHEMA = T.StructType([
+    T.StructField("func_hash", T.StringType()),
+    T.StructField("origin_tpl", T.StringType()),
+    # null for the origins resolved by path, the `0` time of resolve_dep
+    T.StructField("origin_time", T.StringType()),
+])
+
+
+def read_signature(sig_file):
+    '''Yield one row per (function, tag) of a tpl signature'''
+    tpl_seq, sig_path = sig_file
+    tpl_id = Path(sig_path).stem
+    with open(sig_path, 'r') as fp:
+        tpl_sig = json.load(fp)
+    for func_hash, func_infos in tpl_sig.items():
+        for tag_pos, (commit_time, func_path) in enumerate(func_infos[1].values()):
+            yield (tpl_id, tpl_seq, func_hash, tag_pos, commit_time, func_path)
+
+
+def resolve_origins(rows, tpl2name):
+    '''Apply `resolve_dep.resolve_func_origin` to the grouped functions'''
+    resolve_dep.tpl2name = tpl2name.value
+    for row in rows:
+        func_info = dict()
+        # the tpl order of the local backend decides the ties
+        for info in sorted(row.infos, key=lambda x: x.tpl_seq):
+            func_info[info.tpl_id] = (
+                time.strptime(info.commit_time, resolve_dep.TIME_FORMAT),
+                info.func_path
+            )
+        origin = resolve_dep.resolve_func_origin(func_info)
+        if origin is None:
+            continue
+        tpl_id_x, origin_time = origin
+        if origin_time != 0:
+            origin_time = time.strftime(resolve_dep.TIME_FORMAT, origin_time)
+        else:
+            origin_time = None
+        yield (row.func_hash, tpl_id_x, origin_time)
+
+
+def obtain_func_info(spark, sig_paths):
+    '''First tag (time, path) of every function in every tpl'''
+    # the signature paths must be readable by the executors
+    sig_files = [(tpl_seq, str(sig_path))
+                 for tpl_seq, sig_path in enumerate(sig_paths)]
+    num_slices = min(len(sig_files), spark.sparkContext.defaultParallelism * 4)
+    tags = spark.createDataFrame(
+        spark.sparkContext
+        .parallelize(sig_files, max(num_slices, 1))
+        .flatMap(read_signature),
+        TAG_SCHEMA
+    )
+    # same format strings sort like their times, ties keep the tag order
+    first_tag = Window.partitionBy("tpl_id", "func_hash") \
+        .orderBy("commit_time", "tag_pos")
+    return tags \
+        .withColumn("rank", F.row_number().over(first_tag)) \
+        .where(F.col("rank") == 1) \
+        .drop("rank", "tag_pos")
+
+
+def obtain_func_origin(spark, func_info, tpl2name):
+    shared = func_info.groupBy("func_hash").agg(
+        F.count("*").alias("tpl_count"),
+        F.collect_list(
+            F.struct("tpl_seq", "tpl_id", "commit_time", "func_path")
+        ).alias("infos")
+    ).where(F.col("tpl_count") > 1)
+    tpl2name = spark.sparkContext.broadcast(tpl2name)
+    return spark.createDataFrame(
+        shared.rdd.mapPartitions(lambda rows: resolve_origins(rows, tpl2name)),
+        ORIGIN_SCHEMA
+    )
+
+
+def resolve_intersection(func_info, func_origin):
+    '''(tpl_id_s, tpl_id_x, func_hash) for every function s reuses from x'''
+    return func_info.join(func_origin, "func_hash") \
+        .where(F.col("origin_tpl") != F.col("tpl_id")) \
+        .where(
+            F.col("origin_time").isNull() |
+            (F.col("origin_time") < F.col("commit_time"))
+        ) \
+        .select(
+            F.col("tpl_id").alias("tpl_id_s"),
+            F.col("origin_tpl").alias("tpl_id_x"),
+            "func_hash"
+        )
+
+
+def reuse_ratio(func_info, intersection):
+    '''Edges passing the reuse threshold, with their reused function count'''
+    func_num = func_info.groupBy("tpl_id").agg(F.count("*").alias("func_num"))
+    reuse_num = intersection.groupBy("tpl_id_s").agg(
+        F.countDistinct("func_hash").alias("reused_num")
+    )
+    inter_num = intersection.groupBy("tpl_id_s", "tpl_id_x").agg(
+        F.count("*").alias("reuse_len")
+    )
+    func_num_x = func_num.select(
+        F.col("tpl_id").alias("tpl_id_x"), F.col("func_num").alias("func_num_x")
+    )
+    reused_num_x = reuse_num.select(
+        F.col("tpl_id_s").alias("tpl_id_x"),
+        F.col("reused_num").alias("reused_num_x")
+    )
+    edges = inter_num \
+        .join(func_num_x, "tpl_id_x") \
+        .join(reused_num_x, "tpl_id_x", "left") \
+        .fillna(0, ["reused_num_x"]) \
+        .where(F.col("func_num_x") - F.col("reused_num_x") >= 1) \
+        .where(F.col("reused_num_x") > 0) \
+        .where(
+            F.col("reuse_len") / F.col("func_num_x") >=
+            F.lit(config.THRESHOLD) * F.col("func_num_x") / F.col("reused_num_x")
+        )
+    return func_num, edges
+
+
+def resolve_with_spark(sig_paths, tpl2name, master="local[*]", report=None):
+    '''
+    Resolve the tpl dependencies of the signature files with pyspark.
+    `report` is the run report of the caller. When resolve_dep runs as a
+    script, this module imports a second copy of it with its own report.
+    '''
+    spark = SparkSession.builder \
+        .master(master) \
+        .appName("tplite") \
+        .getOrCreate()
+    # ship the pipeline modules to the python workers
+    for module_path in Path(__file__).resolve().parent.glob("*.py"):
+        spark.sparkContext.addPyFile(str(module_path))
+    try:
+        logger.info("[+] construct the info of functions")
+        func_info = obtain_func_info(spark, sig_paths).persist()
+
+        logger.info("[+] construct the origin tpl of functions")
+        func_origin = obtain_func_origin(spark, func_info, tpl2name)
+
+        logger.info("[+] resolve the source relation")
+        intersection = resolve_intersection(func_info, func_origin).persist()
+        func_num, edges = reuse_ratio(func_info, intersection)
+
+        func_num = {row.tpl_id: row.func_num for row in func_num.collect()}
+        inter_num = dict()
+        for row in edges.collect():
+            inter_num[(row.tpl_id_s, row.tpl_id_x)] = row.reuse_len
+        logger.info(f"[+] {len(inter_num)} edges pass the reuse threshold")
+    finally:
+        spark.stop()
+    if report is None:
+        report = resolve_dep.report
+    return resolve_dep.filter_relations(
+        set(inter_num), func_num, inter_num, report=report
+    )